@@ -1,10 +1,19 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Any
+import numpy as np
 import pandas as pd
 import math
+import os
 import logging
-from utils.recommend import get_recommendations  # your custom recommender
+import threading
+from utils.recommend import get_engine, assign_tracks, ingest_tracks  # your custom recommender
+from utils.storage import read_dataset
+from utils.cache import LRUCache
+from backend.serving import ScoringService
 
 # =============================
 # Logging
@@ -17,7 +26,7 @@ logger = logging.getLogger(__name__)
 # =============================
 DATA_PATH = "clustered_datasets_new/spotify_spectral_with_preview.csv"
 try:
-    df = pd.read_csv(DATA_PATH)
+    df = read_dataset(DATA_PATH)
 except Exception as e:
     logger.error(f"Failed to load dataset: {e}")
     raise
@@ -27,10 +36,83 @@ for col in ["preview_url", "album_art"]:
     if col not in df.columns:
         df[col] = None
 
+# =============================
+# Track id index (id -> row position, first occurrence wins)
+# =============================
+def build_id_lookup(frame):
+    """(Index of ids, their row positions); one tuple so it is swapped atomically"""
+    first_rows = ~frame["id"].duplicated(keep="first").to_numpy()
+    return pd.Index(frame["id"].to_numpy()[first_rows]), np.flatnonzero(first_rows)
+
+ID_LOOKUP = build_id_lookup(df)
+_APPEND_LOCK = threading.Lock()
+
+def append_tracks(frame):
+    """
+    Add rows for ids not in df yet. df only grows, and it is swapped before
+    ID_LOOKUP, so every position a reader can look up is valid in the df it sees.
+    """
+    global df, ID_LOOKUP
+    if frame is None or len(frame) == 0:
+        return 0
+    with _APPEND_LOCK:
+        new = frame[~frame["id"].isin(ID_LOOKUP[0])].drop_duplicates("id")
+        if len(new) == 0:
+            return 0
+        grown = pd.concat([df, new.reindex(columns=df.columns)], ignore_index=True)
+        lookup = build_id_lookup(grown)
+        df = grown
+        ID_LOOKUP = lookup
+    return len(new)
+
+FEATURE_COLS = [
+    "danceability", "energy", "valence", "speechiness",
+    "instrumentalness", "acousticness", "liveness", "tempo"
+]
+
+# =============================
+# Recommender engines (one per algo, loaded once at startup)
+# =============================
+RECOMMENDER_ALGO = "spectral"
+ENGINES = {algo: get_engine(algo) for algo in [RECOMMENDER_ALGO]}
+
+# Songs ingested in earlier runs (persisted next to the engine's dataset)
+append_tracks(ENGINES[RECOMMENDER_ALGO].ingested())
+
+# =============================
+# Scoring executor (bounded, single-flight, optional micro-batching)
+# =============================
+SCORING = ScoringService(
+    max_workers=int(os.getenv("RECOMMENDER_WORKERS", "4")),
+    batch_window_ms=float(os.getenv("RECOMMENDER_BATCH_WINDOW_MS", "0")),
+    max_batch=int(os.getenv("RECOMMENDER_MAX_BATCH", "256")),
+)
+
+# Catalog updates run one at a time, off the scoring pool
+INGESTION = ScoringService(max_workers=1)
+
+# =============================
+# Response cache (keyed on the engine's artifact version)
+# =============================
+RESPONSE_CACHE = LRUCache(
+    maxsize=int(os.getenv("RECOMMEND_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("RECOMMEND_CACHE_TTL", "0")),
+)
+
+def cache_key(track_id, n, mode):
+    engine = ENGINES[RECOMMENDER_ALGO]
+    return (engine.version, RECOMMENDER_ALGO, track_id, n, mode)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    SCORING.shutdown()
+    INGESTION.shutdown()
+
 # =============================
 # FastAPI app
 # =============================
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -46,6 +128,19 @@ class RecommendationRequest(BaseModel):
     n: int = 10
     mode: str = "cluster_knn"  # cluster | knn | cluster_knn
 
+class BatchRecommendationRequest(BaseModel):
+    track_ids: list[str]
+    n: int = 10
+    mode: str = "cluster_knn"  # cluster | knn | cluster_knn
+
+class IngestRequest(BaseModel):
+    tracks: list[dict[str, Any]]  # id, name, artists, raw audio features (+ preview_url, album_art, ...)
+
+class AssignRequest(BaseModel):
+    tracks: list[dict[str, float | None]]  # raw audio features per track
+    n: int = 10
+    mode: str = "cluster_knn"  # knn | cluster_knn
+
 # =============================
 # Helpers
 # =============================
@@ -62,32 +157,81 @@ def sanitize_json(data):
     else:
         return data
 
+def json_records(frame):
+    """Rows of frame as JSON-safe dicts (NaN/Inf -> None) without a recursive walk"""
+    frame = frame.replace([np.inf, -np.inf], np.nan)
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+def ndjson_chunks(frame, positions, col_idx, chunk_size=1000):
+    """Yield NDJSON lines for frame rows at positions (columns at col_idx), one chunk at a time"""
+    for start in range(0, len(positions), chunk_size):
+        chunk = frame.iloc[positions[start:start + chunk_size], col_idx]
+        text = chunk.to_json(orient="records", lines=True, double_precision=15, force_ascii=False)
+        yield text if text.endswith("\n") else text + "\n"
+
+def format_recommendations(recs_df, metadata):
+    """Merge recommender output with fetched metadata for the response"""
+    recommendations = []
+    for row in recs_df.to_dict(orient="records"):
+        tid = row["id"]
+        m = metadata.get(tid, {})
+        recommendations.append({
+            "id": tid,
+            "name": row.get("name") or m.get("name"),
+            "artist": row.get("artists") or m.get("artist"),
+            "album_art": m.get("album_art"),
+            "preview_url": m.get("preview_url"),
+            "similarity": row.get("similarity")
+        })
+    return recommendations
+
+def recommend_payload(track_id, n, mode):
+    """Recommendations + metadata for one seed (runs on the scoring executor)"""
+    recs_df = ENGINES[RECOMMENDER_ALGO].recommend(track_id, n=n, mode=mode)
+    metadata = fetch_metadata(recs_df["id"].tolist())
+    return {"recommendations": sanitize_json(format_recommendations(recs_df, metadata))}
+
+def batch_payloads(group, track_ids):
+    """recommend_payload for many seeds sharing (n, mode), scored as one batch"""
+    n, mode = group
+    recs = ENGINES[RECOMMENDER_ALGO].recommend_batch(track_ids, n=n, mode=mode)
+
+    # One metadata gather for every recommended id across all seeds
+    all_ids = list(dict.fromkeys(tid for recs_df in recs.values() for tid in recs_df["id"]))
+    metadata = fetch_metadata(all_ids)
+    return {
+        tid: {"recommendations": sanitize_json(format_recommendations(recs_df, metadata))}
+        for tid, recs_df in recs.items()
+    }
+
+def lookup_positions(track_ids):
+    """Row positions in df for track_ids (-1 where the id is unknown)"""
+    index, positions = ID_LOOKUP
+    found = index.get_indexer(track_ids)
+    return np.where(found >= 0, positions[found], -1)
+
 def fetch_metadata(track_ids: list[str]):
-    """Fetch metadata from df"""
-    metadata = {}
-    feature_cols = [
-        "danceability", "energy", "valence", "speechiness",
-        "instrumentalness", "acousticness", "liveness", "tempo"
-    ]
-    for tid in track_ids:
-        row = df[df["id"] == tid]
-        if not row.empty:
-            row = row.iloc[0]
-            metadata[tid] = {
-                "name": row.get("name"),
-                "artist": row.get("artists"),
-                "album_art": row.get("album_art"),
-                "preview_url": row.get("preview_url"),
-                "features": {col: row.get(col, 0) for col in feature_cols} if all(col in row for col in feature_cols) else None
-            }
-        else:
-            metadata[tid] = {
-                "name": None,
-                "artist": None,
-                "album_art": None,
-                "preview_url": None,
-                "features": None
-            }
+    """Fetch metadata from df with one gather over the id index"""
+    metadata = {
+        tid: {"name": None, "artist": None, "album_art": None, "preview_url": None, "features": None}
+        for tid in track_ids
+    }
+    positions = lookup_positions(track_ids)
+    hits = positions >= 0
+    if not hits.any():
+        return metadata
+
+    has_features = all(col in df.columns for col in FEATURE_COLS)
+    cols = ["name", "artists", "album_art", "preview_url"] + (FEATURE_COLS if has_features else [])
+    rows = df[cols].iloc[positions[hits]].to_dict(orient="records")
+    for tid, row in zip(np.asarray(track_ids, dtype=object)[hits], rows):
+        metadata[tid] = {
+            "name": row["name"],
+            "artist": row["artists"],
+            "album_art": row["album_art"],
+            "preview_url": row["preview_url"],
+            "features": {col: row[col] for col in FEATURE_COLS} if has_features else None
+        }
     return metadata
 
 # =============================
@@ -98,63 +242,227 @@ def root():
     return {"message": "Spotify recommender API running"}
 
 @app.get("/clusters")
-def get_clusters():
-    """Return all songs"""
+def get_clusters(
+    offset: int = 0,
+    limit: int | None = None,
+    cursor: str | None = None,
+    fields: str | None = None,
+    random_sample: bool = False,
+    sample_size: int = 500,
+    seed: int | None = None,
+    format: str = "json",
+):
+    """
+    Return songs (all of them by default).
+
+    offset/limit or cursor paginate, fields=id,name,... projects columns,
+    random_sample=true draws sample_size songs server-side (pass seed, or
+    follow next_cursor, for stable pages), format=ndjson streams one song
+    per line instead of building the whole list.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    if cursor is not None:
+        try:
+            parts = cursor.split(":")
+            offset = int(parts[0])
+            if len(parts) > 1:
+                seed = int(parts[1])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    if offset < 0 or (limit is not None and limit < 0) or sample_size < 0:
+        raise HTTPException(status_code=400, detail="offset, limit and sample_size must be >= 0")
+
+    frame = df  # one snapshot; append_tracks may swap df mid-request
+    columns = list(frame.columns)
+    if fields:
+        columns = [c.strip() for c in fields.split(",") if c.strip()]
+        unknown = [c for c in columns if c not in frame.columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {unknown}")
+    col_idx = frame.columns.get_indexer(columns)
+
+    if random_sample:
+        if seed is None:
+            seed = int(np.random.randint(0, 2**31 - 1))
+        rng = np.random.RandomState(seed)
+        positions = rng.choice(len(frame), size=min(sample_size, len(frame)), replace=False)
+    else:
+        positions = np.arange(len(frame))
+
+    total = len(positions)
+    end = total if limit is None else min(total, offset + limit)
+    page = positions[offset:end]
+    next_cursor = None
+    if end < total:
+        next_cursor = f"{end}:{seed}" if random_sample else str(end)
+
+    # Rows are picked before columns, so only the page is ever copied
     try:
-        data = df.where(pd.notnull(df), None).to_dict(orient="records")
-        return {"songs": sanitize_json(data)}
+        if format == "ndjson":
+            headers = {"X-Total-Count": str(total)}
+            if next_cursor is not None:
+                headers["X-Next-Cursor"] = next_cursor
+            return StreamingResponse(
+                ndjson_chunks(frame, page, col_idx), media_type="application/x-ndjson", headers=headers
+            )
+        return {
+            "songs": json_records(frame.iloc[page, col_idx]),
+            "total": total,
+            "offset": offset,
+            "next_cursor": next_cursor,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/recommend")
-def recommend(request: RecommendationRequest):
+async def recommend(request: RecommendationRequest):
     """Return top N recommendations using your recommender"""
-    if request.track_id not in df["id"].values:
+    if request.track_id not in ID_LOOKUP[0]:
         raise HTTPException(status_code=404, detail="Track not found")
 
+    key = cache_key(request.track_id, request.n, request.mode)
+    cached = RESPONSE_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    async def compute():
+        if SCORING.batching:
+            return await SCORING.submit_batched(
+                (request.n, request.mode), request.track_id, batch_payloads
+            )
+        return await SCORING.call(recommend_payload, request.track_id, request.n, request.mode)
+
     try:
-        recs_df = get_recommendations(
-            song_id=request.track_id,
-            algo="spectral",
-            n=request.n,
-            mode=request.mode
-        )
-    except ValueError:
+        payload = await SCORING.single_flight(key, compute)
+    except (ValueError, KeyError):
         raise HTTPException(status_code=404, detail="Track not found")
     except Exception as e:
         logger.error(f"Error generating recommendations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    RESPONSE_CACHE.put(key, payload)
+    return payload
 
-    track_ids = recs_df["id"].tolist()
-    metadata = fetch_metadata(track_ids)
+@app.post("/recommend/batch")
+async def recommend_batch(request: BatchRecommendationRequest):
+    """Return top N recommendations for many seed tracks in one response"""
+    if request.mode not in ("cluster", "knn", "cluster_knn"):
+        raise HTTPException(status_code=400, detail=f"Unsupported mode: {request.mode}")
 
-    recommendations = []
-    for _, row in recs_df.iterrows():
-        tid = row["id"]
-        m = metadata.get(tid, {})
-        recommendations.append({
-            "id": tid,
-            "name": row.get("name") or m.get("name"),
-            "artist": row.get("artists") or m.get("artist"),
-            "album_art": m.get("album_art"),
-            "preview_url": m.get("preview_url"),
-            "similarity": row.get("similarity")
-        })
+    # Serve cached seeds directly, score only the rest
+    payloads, todo = {}, []
+    for tid in dict.fromkeys(request.track_ids):
+        cached = RESPONSE_CACHE.get(cache_key(tid, request.n, request.mode))
+        if cached is not None:
+            payloads[tid] = cached
+        else:
+            todo.append(tid)
+
+    if todo:
+        try:
+            computed = await SCORING.call(batch_payloads, (request.n, request.mode), todo)
+        except Exception as e:
+            logger.error(f"Error generating batch recommendations: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        for tid, payload in computed.items():
+            RESPONSE_CACHE.put(cache_key(tid, request.n, request.mode), payload)
+        payloads.update(computed)
+
+    results = {tid: payload["recommendations"] for tid, payload in payloads.items()}
+    missing = [tid for tid in dict.fromkeys(request.track_ids) if tid not in payloads]
+    return {"results": results, "missing": missing}
+
+@app.post("/assign")
+async def assign(request: AssignRequest):
+    """Cluster ids + nearest catalog songs for tracks that are not in the catalog"""
+    if request.mode not in ("knn", "cluster_knn"):
+        raise HTTPException(status_code=400, detail=f"Unsupported mode: {request.mode}")
+    if not request.tracks:
+        raise HTTPException(status_code=400, detail="No tracks given")
+
+    def compute():
+        clusters, neighbours, info = assign_tracks(
+            request.tracks, algo=RECOMMENDER_ALGO, n=request.n, mode=request.mode
+        )
+        all_ids = list(dict.fromkeys(tid for recs_df in neighbours for tid in recs_df["id"]))
+        metadata = fetch_metadata(all_ids)
+        return {
+            "assignments": [
+                {"cluster": int(cluster), "recommendations": sanitize_json(format_recommendations(recs_df, metadata))}
+                for cluster, recs_df in zip(clusters, neighbours)
+            ],
+            **info,
+        }
+
+    try:
+        return await SCORING.call(compute)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error assigning tracks: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ingest")
+async def ingest(request: IngestRequest):
+    """
+    Add new tracks to the served catalog: projected with the saved
+    scaler/PCA, assigned a cluster and swapped in without a restart
+    (requests keep being served from the previous catalog meanwhile)
+    """
+    if not request.tracks:
+        raise HTTPException(status_code=400, detail="No tracks given")
+
+    def compute():
+        added, info = ingest_tracks(request.tracks, algo=RECOMMENDER_ALGO)
+        append_tracks(added)
+        engine = ENGINES[RECOMMENDER_ALGO]
+        return {
+            "ingested": {tid: int(c) for tid, c in zip(added["id"], added[engine.cluster_col])},
+            "skipped": len(request.tracks) - len(added),
+            "total": len(engine),
+            "version": engine.version,
+            **info,
+        }
+
+    try:
+        return await INGESTION.call(compute)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error ingesting tracks: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/reload")
+def reload_engines():
+    """Re-read clustered datasets after the artifacts have been regenerated"""
+    try:
+        for engine in ENGINES.values():
+            engine.reload()
+    except Exception as e:
+        logger.error(f"Error reloading engines: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"reloaded": {algo: len(engine) for algo, engine in ENGINES.items()}}
+
+@app.get("/stats")
+def get_stats():
+    """Cache and scoring counters plus the artifact version being served"""
+    return {
+        "versions": {algo: engine.version for algo, engine in ENGINES.items()},
+        "cache": RESPONSE_CACHE.stats(),
+        "scoring": dict(SCORING.stats),
+    }
 
-    return {"recommendations": sanitize_json(recommendations)}
 @app.get("/song/{track_id}")
 def get_song(track_id: str):
     """Fetch metadata + features for a single song by track_id"""
-    row = df[df["id"] == track_id]
-    if row.empty:
+    pos = lookup_positions([track_id])[0]
+    if pos < 0:
         raise HTTPException(status_code=404, detail="Track not found")
 
-    row = row.iloc[0]
-
-    feature_cols = [
-        "danceability", "energy", "valence", "speechiness",
-        "instrumentalness", "acousticness", "liveness", "tempo"
-    ]
+    row = df.iloc[pos]
 
     song = {
         "id": row.get("id"),
@@ -162,7 +470,7 @@ def get_song(track_id: str):
         "artist": row.get("artists"),
         "album_art": row.get("album_art"),
         "preview_url": row.get("preview_url"),
-        "features": {col: row.get(col, 0) for col in feature_cols if col in row}
+        "features": {col: row.get(col, 0) for col in FEATURE_COLS if col in row}
     }
 
     return sanitize_json(song)
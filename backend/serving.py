@@ -0,0 +1,99 @@
+# backend/serving.py
+"""
+Async helpers for running CPU-bound scoring off the event loop.
+
+    - ScoringService.call: run a function on a bounded thread pool
+    - ScoringService.single_flight: identical in-flight requests share one
+      computation
+    - ScoringService.submit_batched: optional micro-batching, requests that
+      arrive within batch_window_ms of each other are scored together
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ScoringService:
+    def __init__(self, max_workers=4, batch_window_ms=0, max_batch=256):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring")
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+        self._inflight = {}
+        self._pending = {}
+        self._timers = {}  # group -> call_later handle of its pending batch
+        self.stats = {"computed": 0, "shared": 0, "batches": 0, "batched_items": 0}
+
+    @property
+    def batching(self):
+        return self.batch_window > 0
+
+    async def call(self, fn, *args):
+        """Run fn(*args) on the bounded executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def single_flight(self, key, make_coro):
+        """
+        Await make_coro(). Concurrent calls with the same key share the
+        in-flight result instead of recomputing it.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(make_coro())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self.stats["computed"] += 1
+        return await asyncio.shield(task)
+
+    async def submit_batched(self, group, item, run_batch):
+        """
+        Queue item under group; after batch_window (or max_batch items) the
+        whole group is handed to run_batch(group, items) on the executor,
+        which must return {item: result}.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(group, [])
+        batch.append((item, future))
+        if len(batch) == 1:
+            self._timers[group] = loop.call_later(self.batch_window, self._schedule_flush, group, run_batch)
+        if len(batch) >= self.max_batch:
+            self._schedule_flush(group, run_batch)
+        return await future
+
+    def _schedule_flush(self, group, run_batch):
+        # An early (max_batch) flush must not leave its timer behind to cut
+        # the next batch of this group short
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(group, None)
+        if batch:
+            asyncio.ensure_future(self._flush(group, batch, run_batch))
+
+    async def _flush(self, group, batch, run_batch):
+        items = list(dict.fromkeys(item for item, _ in batch))
+        self.stats["batches"] += 1
+        self.stats["batched_items"] += len(batch)
+        try:
+            results = await self.call(run_batch, group, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item, future in batch:
+            if future.done():
+                continue
+            if item in results:
+                future.set_result(results[item])
+            else:
+                future.set_exception(KeyError(item))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
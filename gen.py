@@ -1,10 +1,10 @@
 # gen_preview_urls.py
 import os
-import pandas as pd
 import requests
 from dotenv import load_dotenv
 from time import sleep
 from tqdm import tqdm
+from utils.storage import read_dataset, write_dataset
 
 # =============================
 # Load environment variables
@@ -40,7 +40,7 @@ HEADERS = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
 INPUT_CSV = "clustered_datasets_new/spotify_spectral_sample.csv"
 OUTPUT_CSV = "clustered_datasets_new/spotify_spectral_with_preview.csv"
 
-df = pd.read_csv(INPUT_CSV)
+df = read_dataset(INPUT_CSV)
 
 # Ensure preview_url and album_art columns exist
 for col in ["preview_url", "album_art"]:
@@ -84,5 +84,5 @@ for i in tqdm(range(0, len(track_ids), BATCH_SIZE)):
 # =============================
 # Save updated CSV
 # =============================
-df.to_csv(OUTPUT_CSV, index=False)
+write_dataset(df, OUTPUT_CSV)
 print(f"Saved preview URLs and album art to {OUTPUT_CSV}")
@@ -1,5 +1,7 @@
 # main.py
 import os
+import time
+import numpy as np
 import pandas as pd
 import joblib
 import json
@@ -11,70 +13,139 @@ from sklearn.metrics import silhouette_score
 # =============================
 # Imports from utils & models
 # =============================
-from utils.preprocessing import load_data, preprocess_data
+from utils.preprocessing import load_data, load_data_chunked, preprocess_incremental
 from models.kmeans_model import search_feature_subsets
-from models.dbscan_model import smart_tune_dbscan
-from models.agglomerative_model import tune_agglomerative
-from models.gmm_model import tune_gmm
-from models.spectral_model import tune_spectral
+from utils.tuning import run_tuning
+from utils.embeddings import build_all_embeddings
+from utils.ann_index import build_all_indexes
+from utils.topk_table import build_all_topk_tables
+from utils.storage import write_dataset, dataset_columns
+from utils.artifacts import (
+    FEATURES_PATH, SCALER_PATH, PCA_PATH, CLUSTERED_PATHS, CATALOG_PATH,
+    SPECTRAL_CLASSIFIER_PATH, SPECTRAL_SCALER_PATH, SPECTRAL_PCA_PATH, ASSIGNER_PATH, CLUSTER_MODEL_PATHS,
+    embedding_paths, topk_paths,
+)
+from utils.embeddings import fold_affine
+from utils.assign import CentroidAssigner
+from utils.evaluation import sample_rows
+from utils.label_catalog import label_catalog
+from utils.pipeline import Pipeline
+from utils.profiling import cost_summary
+from utils import (
+    preprocessing, evaluation, tuning as tuning_module, storage, embeddings, ann_index, topk_table, assign,
+    label_catalog as label_catalog_module,
+)
+from models import kmeans_model, dbscan_model, agglomerative_model, gmm_model, spectral_model
 
-if __name__ == "__main__":
-    # =============================
-    # Setup folders
-    # =============================
-    folders = [
-        "saved_models/kmeans",
-        "saved_models/dbscan",
-        "saved_models/agglomerative",
-        "saved_models/gmm",
-        "saved_models/spectral",
-        "saved_models/spectral_classifier",
-        "results/kmeans",
-        "results/dbscan",
-        "results/agglomerative",
-        "results/gmm",
-        "results/spectral",
-        "reports/kmeans",
-        "reports/dbscan",
-        "reports/agglomerative",
-        "reports/gmm",
-        "reports/spectral",
-        "clustered_datasets_old",
-        "clustered_datasets_new"
-    ]
-    for f in folders:
-        os.makedirs(f, exist_ok=True)
-
-    # =============================
-    # Load Data
-    # =============================
-    df = load_data("data/spotify_tracks_clean.csv")
+TUNING_RESULTS = {
+    "dbscan": "results/dbscan/results_dbscan_smart.csv",
+    "agglomerative": "results/agglomerative/results_agglomerative_grid.csv",
+    "gmm": "results/gmm/results_gmm_grid.csv",
+    "spectral": "results/spectral/results_spectral_focused_wide.csv",
+}
+TUNING_CODE = {
+    "dbscan": dbscan_model,
+    "agglomerative": agglomerative_model,
+    "gmm": gmm_model,
+    "spectral": spectral_model,
+}
+FINAL_MODELS = [
+    CLUSTER_MODEL_PATHS["kmeans"],
+    "saved_models/agglomerative/agglomerative_best_model_sample.joblib",
+    CLUSTER_MODEL_PATHS["gmm"],
+]
+DBSCAN_MODEL_PATH = "saved_models/dbscan/dbscan_best_model_sample.joblib"
+SPECTRAL_MODEL_PATH = "saved_models/spectral/spectral_best_model_sample.joblib"
+# Written only when a valid spectral clustering was found
+SPECTRAL_ARTIFACTS = [
+    SPECTRAL_MODEL_PATH, SPECTRAL_CLASSIFIER_PATH, SPECTRAL_SCALER_PATH, SPECTRAL_PCA_PATH, ASSIGNER_PATH,
+]
 
-    # =============================
-    # Define all candidate features
-    # =============================
-    features = [
-        "danceability","energy","loudness","speechiness","acousticness",
-        "instrumentalness","liveness","valence","tempo","duration_ms"
-    ]
-
-    sample_size_full = 10000
-    sample_size_tune = 8000
 
-    # =============================
-    # Step 0: KMeans Feature Subset Selection
-    # =============================
-    best_features, best_score, best_scaler, best_pca, best_X_sample, best_kmeans_model_params, subset_results = search_feature_subsets(
-        df, features, preprocess_data, sample_size=sample_size_full, n_subsets=30, cluster_range=(5, 10)
+# =============================
+# Stage: KMeans feature subset selection
+# =============================
+def subset_search_stage(df, features, sample_size, n_subsets, cluster_range, variance_threshold, save_scaler=True):
+    best_features, best_score, best_scaler, best_pca, best_X_sample, best_kmeans_model_params, subset_results, sample_index = search_feature_subsets(
+        df, features, sample_size=sample_size, n_subsets=n_subsets, cluster_range=cluster_range,
+        variance_threshold=variance_threshold, return_index=True
     )
     print(f"\n✅ Best Feature Subset: {best_features}")
     print(f"Silhouette Score on sample: {best_score:.4f}")
 
-    # Save best_features for recommendation pipeline
-    # Save best_features for recommendation pipeline
+    # Save best_features, scaler and PCA for the recommendation pipeline
+    # (save_scaler=False: incremental_preprocessing_stage writes them instead)
     best_features_list = best_features.tolist()  # convert ndarray -> list
-    with open("saved_models/kmeans/best_features.json", "w") as f:
+    with open(FEATURES_PATH, "w") as f:
         json.dump(best_features_list, f)
+    if save_scaler:
+        joblib.dump(best_scaler, SCALER_PATH)
+        joblib.dump(best_pca, PCA_PATH)
+
+    return {
+        "features": best_features_list,
+        "score": best_score,
+        "scaler": best_scaler,
+        "pca": best_pca,
+        "X_sample": best_X_sample,
+        "sample_index": sample_index,  # df rows of X_sample
+        "kmeans_params": best_kmeans_model_params,
+    }
+
+
+# =============================
+# Stage: out-of-core scaler + PCA (PREPROCESSING=chunked)
+# =============================
+def incremental_preprocessing_stage(df, data_path, subset, variance_threshold):
+    """
+    Refit the scaler and PCA of the chosen features over the whole catalog
+    with partial_fit (the search fits them on one sample), save them as the
+    serving artifacts and re-project the sample rows with them.
+    """
+    print("\n=== Fitting scaler + PCA over the full catalog (out of core) ===")
+    scaler, pca = preprocess_incremental(data_path, subset["features"], variance_threshold=variance_threshold)
+    joblib.dump(scaler, SCALER_PATH)
+    joblib.dump(pca, PCA_PATH)
+    print(f"PCA keeps {pca.n_components_} components over {pca.n_samples_} tracks")
+
+    W, b = fold_affine(scaler, pca)
+    X_sample = df.iloc[subset["sample_index"]][subset["features"]].to_numpy(dtype=np.float64) @ W + b
+    return {**subset, "scaler": scaler, "pca": pca, "X_sample": X_sample}
+
+
+# =============================
+# Stage: tuning results per algorithm
+# =============================
+def save_tuning_results(algo, results):
+    pd.DataFrame(results).to_csv(TUNING_RESULTS[algo], index=False)
+    return results
+
+
+# =============================
+# Stage: final fits on the sample (+ Spectral classifier)
+# =============================
+def holdout_split(df, subset, W, b, random_state=42):
+    """
+    (rows to fit on, held-out rows), both projected: the sample and up to as
+    many catalog rows outside it. When the sample is the whole catalog a
+    fifth of it is held out instead.
+    """
+    X_sample = subset["X_sample"]
+    unseen = np.setdiff1d(np.arange(len(df)), subset["sample_index"])
+    if len(unseen) == 0:
+        order = np.random.RandomState(random_state).permutation(len(X_sample))
+        cut = len(order) // 5
+        return X_sample[order[cut:]], X_sample[order[:cut]]
+    unseen = sample_rows(unseen, len(X_sample), random_state)
+    raw = df.iloc[unseen][subset["features"]].fillna(0).to_numpy(dtype=np.float64)
+    return X_sample, raw @ W + b
+
+
+def final_fit_stage(df, subset, tuning):
+    """Fit each algorithm's best params on the sample; returns {algo: labels or None}."""
+    best_X_sample = subset["X_sample"]
+    best_kmeans_model_params = subset["kmeans_params"]
+    labels = {}
 
     # =============================
     # Step 1: KMeans
@@ -91,24 +162,17 @@ if __name__ == "__main__":
     sil_kmeans = silhouette_score(best_X_sample, final_kmeans.labels_)
     print(f"KMeans silhouette score: {sil_kmeans:.4f}")
 
-    joblib.dump(final_kmeans, "saved_models/kmeans/kmeans_best_model_sample_features.joblib")
-    joblib.dump(best_scaler, "saved_models/kmeans/scaler_sample_features.joblib")
-    joblib.dump(best_pca, "saved_models/kmeans/pca_sample_features.joblib")
-
-    # Save clustered dataset
-    df_sample_kmeans = df.sample(n=len(best_X_sample), random_state=42).copy()
-    df_sample_kmeans["cluster_kmeans"] = final_kmeans.labels_
-    df_sample_kmeans.to_csv("clustered_datasets_old/spotify_kmeans_sample.csv", index=False)
+    joblib.dump(final_kmeans, CLUSTER_MODEL_PATHS["kmeans"])
+    labels["kmeans"] = final_kmeans.labels_
 
     # =============================
     # Step 2: DBSCAN
     # =============================
-    print("\n=== Running Smart DBSCAN Tuning on sample ===")
-    results_dbscan = smart_tune_dbscan(best_X_sample, n_trials=50, sample_size=sample_size_full)
-    df_dbscan = pd.DataFrame(results_dbscan)
-    df_dbscan.to_csv("results/dbscan/results_dbscan_smart.csv", index=False)
+    print("\n=== Smart DBSCAN results on sample ===")
+    df_dbscan = pd.DataFrame(tuning["dbscan"])
 
     df_valid = df_dbscan.dropna(subset=["silhouette"])
+    labels["dbscan"] = None
     if not df_valid.empty:
         best_dbscan = df_valid.loc[df_valid["silhouette"].idxmax()]
         final_dbscan = DBSCAN(**best_dbscan['params'])
@@ -116,10 +180,8 @@ if __name__ == "__main__":
         sil_dbscan = silhouette_score(best_X_sample, final_dbscan.labels_)
         print(f"DBSCAN silhouette score: {sil_dbscan:.4f}")
 
-        joblib.dump(final_dbscan, "saved_models/dbscan/dbscan_best_model_sample.joblib")
-        df_sample_dbscan = df.sample(n=len(best_X_sample), random_state=42).copy()
-        df_sample_dbscan["cluster_dbscan"] = final_dbscan.labels_
-        df_sample_dbscan.to_csv("clustered_datasets_old/spotify_dbscan_sample.csv", index=False)
+        joblib.dump(final_dbscan, DBSCAN_MODEL_PATH)
+        labels["dbscan"] = final_dbscan.labels_
     else:
         print("⚠️ No valid DBSCAN clustering found (all noise or single cluster).")
 
@@ -127,9 +189,7 @@ if __name__ == "__main__":
     # Step 3: Agglomerative
     # =============================
     print("\n=== Running Agglomerative Clustering ===")
-    results_agglom_grid = tune_agglomerative(best_X_sample, cluster_range=(3, 10), sample_size=sample_size_full)
-    df_agglom_grid = pd.DataFrame(results_agglom_grid)
-    df_agglom_grid.to_csv("results/agglomerative/results_agglomerative_grid.csv", index=False)
+    df_agglom_grid = pd.DataFrame(tuning["agglomerative"])
 
     best_agglom = df_agglom_grid.loc[df_agglom_grid["silhouette"].idxmax()]
     final_agglom = AgglomerativeClustering(**best_agglom["params"])
@@ -137,46 +197,30 @@ if __name__ == "__main__":
     sil_agglom = silhouette_score(best_X_sample, labels_agglom)
     print(f"Agglomerative silhouette score: {sil_agglom:.4f}")
     joblib.dump(final_agglom, "saved_models/agglomerative/agglomerative_best_model_sample.joblib")
-
-    df_sample_agglom = df.sample(n=len(best_X_sample), random_state=42).copy()
-    df_sample_agglom["cluster_agglomerative"] = labels_agglom
-    df_sample_agglom.to_csv("clustered_datasets_old/spotify_agglomerative_sample.csv", index=False)
+    labels["agglomerative"] = labels_agglom
 
     # =============================
     # Step 4: GMM
     # =============================
     print("\n=== Running GMM ===")
-    results_gmm = tune_gmm(best_X_sample, cluster_range=(3, 10), sample_size=sample_size_full)
-    df_gmm = pd.DataFrame(results_gmm)
-    df_gmm.to_csv("results/gmm/results_gmm_grid.csv", index=False)
+    df_gmm = pd.DataFrame(tuning["gmm"])
 
     best_gmm = df_gmm.loc[df_gmm["silhouette"].idxmax()]
     final_gmm = GaussianMixture(**best_gmm["params"])
     final_gmm.fit(best_X_sample)
     sil_gmm = silhouette_score(best_X_sample, final_gmm.predict(best_X_sample))
     print(f"GMM silhouette score: {sil_gmm:.4f}")
-    joblib.dump(final_gmm, "saved_models/gmm/gmm_best_model_sample.joblib")
-
-    df_sample_gmm = df.sample(n=len(best_X_sample), random_state=42).copy()
-    df_sample_gmm["cluster_gmm"] = final_gmm.predict(best_X_sample)
-    df_sample_gmm.to_csv("clustered_datasets_old/spotify_gmm_sample.csv", index=False)
+    joblib.dump(final_gmm, CLUSTER_MODEL_PATHS["gmm"])
+    labels["gmm"] = final_gmm.predict(best_X_sample)
 
     # =============================
     # Step 5: Spectral Clustering (sample-only)
     # =============================
     print("\n=== Running Spectral Clustering ===")
-    results_spectral = tune_spectral(
-        best_X_sample,
-        cluster_range=(3, 3),
-        sample_size=sample_size_tune,
-        affinity_methods=["rbf"],
-        gamma_list=[0.45, 0.5, 0.55],
-        assign_labels_list=["kmeans"]
-    )
-    df_spectral = pd.DataFrame(results_spectral)
-    df_spectral.to_csv("results/spectral/results_spectral_focused_wide.csv", index=False)
+    df_spectral = pd.DataFrame(tuning["spectral"])
 
     df_valid_spectral = df_spectral.dropna(subset=["silhouette"])
+    labels["spectral"] = None
     if not df_valid_spectral.empty:
         best_spectral = df_valid_spectral.loc[df_valid_spectral["silhouette"].idxmax()]
         final_spectral = SpectralClustering(
@@ -190,22 +234,275 @@ if __name__ == "__main__":
         final_spectral.fit(best_X_sample)
         sil_spectral = silhouette_score(best_X_sample, final_spectral.labels_)
         print(f"Spectral silhouette score: {sil_spectral:.4f}")
-        joblib.dump(final_spectral, "saved_models/spectral/spectral_best_model_sample.joblib")
+        joblib.dump(final_spectral, SPECTRAL_MODEL_PATH)
 
         # Train classifier to mimic Spectral
         clf_spectral = RandomForestClassifier(n_estimators=200, random_state=42)
         clf_spectral.fit(best_X_sample, final_spectral.labels_)
-        joblib.dump(clf_spectral, "saved_models/spectral_classifier/spectral_classifier.joblib")
-        joblib.dump(best_scaler, "saved_models/spectral_classifier/scaler_sample_features.joblib")
-        joblib.dump(best_pca, "saved_models/spectral_classifier/pca_sample_features.joblib")
+        joblib.dump(clf_spectral, SPECTRAL_CLASSIFIER_PATH)
+        joblib.dump(subset["scaler"], SPECTRAL_SCALER_PATH)
+        joblib.dump(subset["pca"], SPECTRAL_PCA_PATH)
 
-        # Save dataset with Spectral clusters
-        df_sample_spectral = df.sample(n=len(best_X_sample), random_state=42).copy()
-        df_sample_spectral["cluster_spectral"] = final_spectral.labels_
-        df_sample_spectral.to_csv("clustered_datasets_new/spotify_spectral_sample.csv", index=False)
+        # Nearest-centroid copy of the classifier for low-latency /assign
+        W, b = fold_affine(subset["scaler"], subset["pca"])
+        X_fit, X_holdout = holdout_split(df, subset, W, b)
+        assigner = CentroidAssigner.fit(clf_spectral, X_fit, W, b, subset["features"], X_holdout=X_holdout)
+        assigner.save(ASSIGNER_PATH)
+        print(f"Nearest-centroid assigner agrees with the classifier on {assigner.agreement:.1%} of {len(X_holdout)} held-out tracks")
+        labels["spectral"] = final_spectral.labels_
 
         print("✅ Spectral clustering + classifier ready for prediction")
     else:
         print("⚠️ No valid Spectral clustering found on sample.")
 
+    return labels
+
+
+def final_fit_outputs(labels):
+    """Model files final_fit_stage wrote (DBSCAN / spectral only when they found a clustering)."""
+    paths = list(FINAL_MODELS)
+    if labels.get("dbscan") is not None:
+        paths.append(DBSCAN_MODEL_PATH)
+    if labels.get("spectral") is not None:
+        paths += SPECTRAL_ARTIFACTS
+    return paths
+
+
+# =============================
+# Stage: clustered datasets
+# =============================
+def export_datasets_stage(df, labels, sample_index):
+    written = []
+    for algo, algo_labels in labels.items():
+        if algo_labels is None:
+            continue
+        df_sample = df.iloc[sample_index].copy()  # the rows the models were fitted on
+        df_sample[f"cluster_{algo}"] = algo_labels
+        write_dataset(df_sample, CLUSTERED_PATHS[algo])
+        written.append(CLUSTERED_PATHS[algo])
+    return written
+
+
+# =============================
+# Stage: embeddings, ANN indexes, top-K tables
+# =============================
+def export_indexes_stage(features, scaler, pca):
+    # Catalog embeddings (scaler + PCA folded, L2-normalised)
+    print("\n=== Precomputing catalog embeddings ===")
+    built_embeddings = build_all_embeddings(features, scaler, pca)
+
+    # ANN indexes for full-catalog knn (memory-mapped by the backend)
+    print("\n=== Building ANN indexes ===")
+    built_indexes = build_all_indexes(kind="ivf", n_probe=8)
+
+    # Precomputed top-K neighbour tables (knn + cluster_knn)
+    print("\n=== Precomputing top-K neighbour tables ===")
+    built_topk = build_all_topk_tables(k=50, n_jobs=-1)
+    return {"embeddings": built_embeddings, "indexes": built_indexes, "topk": built_topk}
+
+
+def export_indexes_outputs(built):
+    """Every file export_indexes_stage wrote, so a deleted one reruns the stage."""
+    paths = []
+    for algo in built["embeddings"]:
+        paths += embedding_paths(algo)
+    for path in built["indexes"].values():
+        paths += sorted(os.path.join(path, name) for name in os.listdir(path))
+    for algo, mode in built["topk"]:
+        paths += topk_paths(algo, mode)
+    return paths
+
+
+if __name__ == "__main__":
+    # =============================
+    # Setup folders
+    # =============================
+    folders = [
+        "saved_models/kmeans",
+        "saved_models/dbscan",
+        "saved_models/agglomerative",
+        "saved_models/gmm",
+        "saved_models/spectral",
+        "saved_models/spectral_classifier",
+        "results/kmeans",
+        "results/dbscan",
+        "results/agglomerative",
+        "results/gmm",
+        "results/spectral",
+        "reports/kmeans",
+        "reports/dbscan",
+        "reports/agglomerative",
+        "reports/gmm",
+        "reports/spectral",
+        "clustered_datasets_old",
+        "clustered_datasets_new"
+    ]
+    for f in folders:
+        os.makedirs(f, exist_ok=True)
+
+    # =============================
+    # Define all candidate features
+    # =============================
+    data_path = CATALOG_PATH
+    features = [
+        "danceability","energy","loudness","speechiness","acousticness",
+        "instrumentalness","liveness","valence","tempo","duration_ms"
+    ]
+
+    sample_size_full = 10000
+    sample_size_tune = 8000
+    tuning_jobs = int(os.environ.get("TUNING_JOBS", -1))  # core budget for the tuning pool
+    # "memory": load the catalog with pandas, scaler + PCA fitted on the search sample.
+    # "chunked": compact chunked load, scaler + PCA refitted over the whole catalog out of core.
+    preprocessing_mode = os.environ.get("PREPROCESSING", "memory")
+    if preprocessing_mode not in ("memory", "chunked"):
+        raise ValueError(f"Unsupported PREPROCESSING: {preprocessing_mode}")
+    subset_params = {
+        "features": features, "sample_size": sample_size_full, "n_subsets": 30, "cluster_range": (5, 10),
+        "variance_threshold": 0.8,
+    }
+    tuning_specs = {
+        "dbscan": {"n_trials": 50, "sample_size": sample_size_full},
+        "agglomerative": {"cluster_range": (3, 10), "sample_size": sample_size_full},
+        "gmm": {"cluster_range": (3, 10), "sample_size": sample_size_full, "mode": "warm", "top_n": 5},
+        "spectral": {
+            "cluster_range": (3, 3),
+            "sample_size": sample_size_tune,
+            "affinity_methods": ["rbf"],
+            "gamma_list": [0.45, 0.5, 0.55],
+            "assign_labels_list": ["kmeans"],
+        },
+    }
+
+    # Every stage below is cached under a hash of its inputs; only stale
+    # stages rerun (PIPELINE_FORCE=all or =stage,stage forces a rerun)
+    pipe = Pipeline()
+
+    # =============================
+    # Load Data
+    # =============================
+    if preprocessing_mode == "chunked":
+        df = pipe.stage(
+            "load",
+            lambda: load_data_chunked(data_path, features, columns=dataset_columns(data_path)),
+            params={"mode": preprocessing_mode, "features": features},
+            files=[data_path],
+            code=[preprocessing],
+        )
+    else:
+        df = pipe.stage("load", lambda: load_data(data_path), files=[data_path], code=[load_data])
+
+    # =============================
+    # Step 0: KMeans Feature Subset Selection
+    # =============================
+    subset = pipe.stage(
+        "subset_search",
+        lambda: subset_search_stage(df, **subset_params, save_scaler=preprocessing_mode == "memory"),
+        params={**subset_params, "mode": preprocessing_mode},
+        code=[subset_search_stage, kmeans_model, preprocessing, evaluation],
+        deps=["load"],
+        outputs=[FEATURES_PATH] + ([SCALER_PATH, PCA_PATH] if preprocessing_mode == "memory" else []),
+    )
+    fitted = "subset_search"  # stage whose scaler / PCA / X_sample the models use
+
+    if preprocessing_mode == "chunked":
+        subset = pipe.stage(
+            "preprocess_incremental",
+            lambda: incremental_preprocessing_stage(df, data_path, subset, subset_params["variance_threshold"]),
+            params={"variance_threshold": subset_params["variance_threshold"]},
+            files=[data_path],
+            code=[incremental_preprocessing_stage, preprocessing],
+            deps=["subset_search"],
+            outputs=[SCALER_PATH, PCA_PATH],
+        )
+        fitted = "preprocess_incremental"
+
+    # =============================
+    # Tuning for steps 2-5: stale algorithms share one process pool,
+    # finished trials saved under results/trials/ and skipped on restart
+    # =============================
+    for algo, spec in tuning_specs.items():
+        pipe.key(
+            f"tune_{algo}",
+            params=spec,
+            code=[save_tuning_results, tuning_module, TUNING_CODE[algo], evaluation],
+            deps=[fitted],
+            outputs=[TUNING_RESULTS[algo]],
+        )
+    stale = {algo: spec for algo, spec in tuning_specs.items() if not pipe.is_fresh(f"tune_{algo}")}
+    fresh_results = {}
+    if stale:
+        print(f"\n=== Tuning {', '.join(stale)} (TUNING_JOBS={tuning_jobs}) ===")
+        start = time.perf_counter()
+        fresh_results = run_tuning(subset["X_sample"], stale, n_jobs=tuning_jobs)
+        pipe.record("tuning_pool", "ran", time.perf_counter() - start)
+    tuning = {
+        algo: pipe.run(f"tune_{algo}", lambda algo=algo: save_tuning_results(algo, fresh_results[algo]))
+        for algo in tuning_specs
+    }
+
+    # =============================
+    # Steps 1-5: final fits
+    # =============================
+    labels = pipe.stage(
+        "final_fit",
+        lambda: final_fit_stage(df, subset, tuning),
+        code=[final_fit_stage, final_fit_outputs, holdout_split, assign],
+        deps=["load", fitted] + [f"tune_{algo}" for algo in tuning_specs],
+        outputs=final_fit_outputs,
+    )
+
+    # =============================
+    # Clustered datasets
+    # =============================
+    pipe.stage(
+        "export_datasets",
+        lambda: export_datasets_stage(df, labels, subset["sample_index"]),
+        code=[export_datasets_stage, storage],
+        deps=["load", "final_fit"],
+        outputs=[CLUSTERED_PATHS[algo] for algo, algo_labels in labels.items() if algo_labels is not None],
+    )
+
+    # =============================
+    # Full catalog labelled by the spectral classifier (chunked, parallel)
+    # =============================
+    index_deps = [fitted, "export_datasets"]
+    if labels.get("spectral") is not None:
+        pipe.stage(
+            "label_catalog",
+            lambda: label_catalog(data_path, features=subset["features"], n_jobs=tuning_jobs),
+            files=[data_path],
+            code=[label_catalog_module, preprocessing, storage],
+            deps=[fitted, "final_fit"],
+            outputs=[CLUSTERED_PATHS["spectral_full"]],
+        )
+        index_deps.append("label_catalog")
+
+    # =============================
+    # Steps 6-8: embeddings, ANN indexes, top-K tables
+    # =============================
+    pipe.stage(
+        "export_indexes",
+        lambda: export_indexes_stage(subset["features"], subset["scaler"], subset["pca"]),
+        code=[export_indexes_stage, embeddings, ann_index, topk_table],
+        deps=index_deps,
+        outputs=export_indexes_outputs,
+    )
+
+    print("\n=== Pipeline stages ===")
+    for name, status, seconds in pipe.history:
+        print(f"{name:<22} {status:<7} {seconds:8.1f}s")
+    print(f"{'total':<22} {'':<7} {sum(seconds for _, _, seconds in pipe.history):8.1f}s")
+
+    # Per-trial cost columns summed per tuner (cached stages report their last run)
+    print("\n=== Tuning cost ===")
+    print(f"{'algo':<14} {'trials':>6} {'fit':>9} {'eval':>9} {'shared':>9} {'peak MB':>8}")
+    for algo, results in tuning.items():
+        cost = cost_summary(results)
+        peak = f"{cost['peak_mem_mb']:8.1f}" if cost["peak_mem_mb"] is not None else f"{'-':>8}"
+        print(
+            f"{algo:<14} {cost['trials']:>6} {cost['fit_time']:8.1f}s {cost['eval_time']:8.1f}s "
+            f"{cost['shared_fit_time']:8.1f}s {peak}"
+        )
+
     print("\n🎉 All clustering done! Old pipeline saved in clustered_datasets_old/, new Spectral classifier in clustered_datasets_new/")
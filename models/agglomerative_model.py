@@ -1,12 +1,65 @@
 # models/agglomerative_model.py
 
 from sklearn.cluster import AgglomerativeClustering
-from utils.evaluation import evaluate_model
+from scipy.cluster.hierarchy import linkage as build_linkage, fcluster, cut_tree
+from utils.evaluation import ClusterEvaluator, sample_rows
+from utils.profiling import TrialProfile
 from tqdm import tqdm
 import numpy as np
 
 
-def tune_agglomerative(X, cluster_range=(3, 10), sample_size=10000, random_state=42):
+def cut_labels(Z, k):
+    """Flat labels with exactly k clusters from a SciPy linkage matrix."""
+    labels = fcluster(Z, k, criterion="maxclust")
+    if len(np.unique(labels)) != k:
+        # Tied merge heights: maxclust can stop short of k, cut_tree is exact
+        labels = cut_tree(Z, n_clusters=k).ravel()
+    return labels
+
+
+LINKAGES = ["ward", "complete", "average", "single"]
+CLUSTER_RANGE = (3, 10)
+SAMPLE_SIZE = 10000
+
+
+def plan_agglomerative(X, cluster_range=CLUSTER_RANGE, sample_size=SAMPLE_SIZE, random_state=42):
+    """
+    (X_used, trials, groups, settings) for tune_agglomerative's grid, in its
+    row order. groups holds the trial indices sharing one merge tree (one
+    linkage); utils/tuning.py runs each group as one pool task.
+    """
+    X_used = sample_rows(X, sample_size, random_state)
+    ks = range(cluster_range[0], cluster_range[1] + 1)
+    trials = [{"n_clusters": k, "linkage": link} for k in ks for link in LINKAGES]
+    groups = [[i for i, t in enumerate(trials) if t["linkage"] == link] for link in LINKAGES]
+    return X_used, trials, groups, {"random_state": random_state}
+
+
+def run_linkage(X_used, evaluator, link, ks):
+    """{k: metrics dict} for every k cut from one merge tree; failures are recorded, not raised."""
+    tree = TrialProfile(X_used)  # the merge tree is shared by every k
+    try:
+        with tree, tree.phase("fit"):
+            Z = build_linkage(X_used, method=link, metric="euclidean")
+    except Exception as e:
+        return {k: TrialProfile(X_used, shared=tree).add_to(_failed(k, link, e)) for k in ks}
+    out = {}
+    for k in ks:
+        profile = TrialProfile(X_used, shared=tree)
+        try:
+            with profile:
+                with profile.phase("fit"):
+                    labels = cut_labels(Z, k)
+                with profile.phase("eval"):
+                    metrics = evaluator.evaluate(labels)
+            metrics["params"] = {"n_clusters": k, "linkage": link}
+            out[k] = profile.add_to(metrics)
+        except Exception as e:
+            out[k] = profile.add_to(_failed(k, link, e))
+    return out
+
+
+def tune_agglomerative(X, cluster_range=CLUSTER_RANGE, sample_size=SAMPLE_SIZE, random_state=42, mode="tree"):
     """
     Grid search for Agglomerative Clustering.
     Parameters:
@@ -18,38 +71,54 @@ def tune_agglomerative(X, cluster_range=(3, 10), sample_size=10000, random_state
             Subset size to speed up clustering (kept at 10000).
         random_state : int
             For reproducibility.
+        mode : str
+            "tree": build the merge tree once per linkage (SciPy) and cut it
+            for every k. "grid": refit AgglomerativeClustering per (k, linkage).
+            Both return the same results structure.
     """
-    if len(X) > sample_size:
-        rng = np.random.RandomState(random_state)
-        idx = rng.choice(len(X), size=sample_size, replace=False)
-        X_used = X[idx]
-    else:
-        X_used = X
+    X_used, trials, groups, _ = plan_agglomerative(X, cluster_range, sample_size, random_state)
 
+    evaluator = ClusterEvaluator(X_used)  # distances computed once for all trials
     results = []
-    linkages = ["ward", "complete", "average", "single"]
-    total = (cluster_range[1] - cluster_range[0] + 1) * len(linkages)
-
-    for k in tqdm(range(cluster_range[0], cluster_range[1] + 1), desc="Agglomerative Tuning"):
-        for link in linkages:
-            try:
-                if link == "ward":
-                    model = AgglomerativeClustering(n_clusters=k, linkage=link)
-                else:
-                    model = AgglomerativeClustering(
-                        n_clusters=k, linkage=link, metric="euclidean"
-                    )
-                labels = model.fit_predict(X_used)
-                metrics = evaluate_model(X_used, labels)
-                metrics["params"] = {"n_clusters": k, "linkage": link}
-                results.append(metrics)
-            except Exception as e:
-                results.append({
-                    "silhouette": None,
-                    "davies_bouldin": None,
-                    "calinski_harabasz": None,
-                    "params": {"n_clusters": k, "linkage": link},
-                    "note": f"Failed with error: {str(e)}"
-                })
+
+    if mode == "tree":
+        by_index = {}
+        for group in tqdm(groups, desc="Agglomerative Tuning (tree)"):
+            link = trials[group[0]]["linkage"]
+            scored = run_linkage(X_used, evaluator, link, [trials[i]["n_clusters"] for i in group])
+            for i in group:
+                by_index[i] = scored[trials[i]["n_clusters"]]
+        # Same row order as the grid mode
+        return [by_index[i] for i in range(len(trials))]
+
+    for params in tqdm(trials, desc="Agglomerative Tuning"):
+        k, link = params["n_clusters"], params["linkage"]
+        profile = TrialProfile(X_used)
+        try:
+            with profile:
+                with profile.phase("fit"):
+                    if link == "ward":
+                        model = AgglomerativeClustering(n_clusters=k, linkage=link)
+                    else:
+                        model = AgglomerativeClustering(
+                            n_clusters=k, linkage=link, metric="euclidean"
+                        )
+                    labels = model.fit_predict(X_used)
+                with profile.phase("eval"):
+                    metrics = evaluator.evaluate(labels)
+            metrics["params"] = {"n_clusters": k, "linkage": link}
+            results.append(profile.add_to(metrics))
+        except Exception as e:
+            results.append(profile.add_to(_failed(k, link, e)))
 
     return results
+
+
+def _failed(k, link, e):
+    return {
+        "silhouette": None,
+        "davies_bouldin": None,
+        "calinski_harabasz": None,
+        "params": {"n_clusters": k, "linkage": link},
+        "note": f"Failed with error: {str(e)}"
+    }
@@ -1,66 +1,137 @@
 from sklearn.cluster import DBSCAN
-from utils.evaluation import evaluate_model
+from sklearn.neighbors import NearestNeighbors, VALID_METRICS
+from utils.evaluation import ClusterEvaluator, sample_rows
+from utils.profiling import TrialProfile
 from tqdm import tqdm
 import numpy as np
+from scipy import sparse
 
-def smart_tune_dbscan(X, n_trials=50, sample_size=10000, random_state=42):
+
+def radius_graph(X, radius, metric):
+    """Sparse distance graph of all pairs within radius (self excluded; DBSCAN adds it back)."""
+    nn = NearestNeighbors(radius=radius, metric=metric).fit(X)
+    return nn.radius_neighbors_graph(mode="distance", sort_results=True)
+
+
+def graph_dbscan(graph, eps, min_samples):
     """
-    Randomized DBSCAN tuner:
-    - Picks random eps, min_samples, metric, algorithm, leaf_size
-    - Trains only on a sample
-    - Ignores results with negative or None silhouette
+    DBSCAN labels from a radius graph built at radius >= eps. Same result as
+    DBSCAN(eps, min_samples) on the raw points, without a neighbour search:
+    the graph is cut down to eps and fitted as a precomputed sparse matrix.
     """
-    rng = np.random.RandomState(random_state)
+    n = graph.shape[0]
+    keep = graph.data <= eps  # explicit zeros (duplicate points) are kept
+    rows = np.repeat(np.arange(n), np.diff(graph.indptr))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=n))])
+    cut = sparse.csr_matrix((graph.data[keep], graph.indices[keep], indptr), shape=graph.shape)
+    model = DBSCAN(eps=eps, min_samples=min_samples, metric="precomputed")
+    return model.fit_predict(cut)
 
-    # Sample X if too large
-    if len(X) > sample_size:
-        idx = rng.choice(len(X), size=sample_size, replace=False)
-        X_used = X[idx]
-    else:
-        X_used = X
 
-    results = []
+N_TRIALS = 50
+SAMPLE_SIZE = 10000
+EPS_RANGE = (0.3, 1.2)
+
+
+def plan_dbscan(X, n_trials=N_TRIALS, sample_size=SAMPLE_SIZE, random_state=42, eps_range=EPS_RANGE):
+    """
+    (X_used, trials, groups, settings): the sample and the random trials
+    smart_tune_dbscan runs, in its order. Every trial is its own group
+    (the radius graph is cached per worker instead).
+    """
+    rng = np.random.RandomState(random_state)
+    X_used = sample_rows(X, sample_size, rng)
 
     metrics_options = ["euclidean", "cosine"]   # keep fast + cosine for audio
     algorithms_options = ["ball_tree", "kd_tree"]  # fast neighbor search
     leaf_sizes = [20, 30, 50]
 
-    for _ in tqdm(range(n_trials), desc="Smart DBSCAN Tuning"):
-        eps = rng.uniform(0.3, 1.2)
+    trials = []
+    for _ in range(n_trials):
+        eps = rng.uniform(*eps_range)
         min_samples = rng.randint(3, 15)
         metric = rng.choice(metrics_options)
         algo = rng.choice(algorithms_options)
         leaf = rng.choice(leaf_sizes)
+        trials.append({
+            "eps": eps,
+            "min_samples": min_samples,
+            "metric": metric,
+            "algorithm": algo,
+            "leaf_size": leaf
+        })
+    groups = [[i] for i in range(len(trials))]
+    return X_used, trials, groups, {"eps_range": list(eps_range), "random_state": random_state}
 
-        try:
-            model = DBSCAN(
-                eps=eps,
-                min_samples=min_samples,
-                metric=metric,
-                algorithm=algo,
-                leaf_size=leaf
-            )
-            labels = model.fit_predict(X_used)
+
+def run_dbscan_trial(X_used, evaluator, params, graphs=None, eps_max=None):
+    """
+    Metrics dict (with params) for one trial, or None when the trial is
+    dropped: one cluster / all noise, silhouette <= 0, or a failed fit.
+    graphs: per-metric cache of (radius graph built at eps_max, profile of
+    the build); None fits DBSCAN(**params) directly.
+    """
+    try:
+        shared = None
+        if graphs is not None:
+            metric = params["metric"]
+            if metric not in VALID_METRICS[params["algorithm"]]:
+                return None
+            if metric not in graphs:
+                shared = TrialProfile(X_used)
+                with shared, shared.phase("fit"):
+                    graph = radius_graph(X_used, eps_max, metric)
+                graphs[metric] = (graph, shared)
+            graph, shared = graphs[metric]
+
+        profile = TrialProfile(X_used, shared=shared)
+        with profile:
+            with profile.phase("fit"):
+                if graphs is not None:
+                    labels = graph_dbscan(graph, params["eps"], params["min_samples"])
+                else:
+                    labels = DBSCAN(**params).fit_predict(X_used)
 
             # Skip if only 1 cluster or all noise
             unique_labels = set(labels)
             if len(unique_labels - {-1}) <= 1:
-                continue
-
-            metrics_dict = evaluate_model(X_used, labels)
-
-            # Keep only positive silhouette
-            if metrics_dict["silhouette"] is not None and metrics_dict["silhouette"] > 0:
-                metrics_dict["params"] = {
-                    "eps": eps,
-                    "min_samples": min_samples,
-                    "metric": metric,
-                    "algorithm": algo,
-                    "leaf_size": leaf
-                }
-                results.append(metrics_dict)
-
-        except Exception:
-            continue
+                return None
+
+            with profile.phase("eval"):
+                metrics_dict = evaluator.evaluate(labels)
+
+        # Keep only positive silhouette
+        if metrics_dict["silhouette"] is not None and metrics_dict["silhouette"] > 0:
+            metrics_dict["params"] = dict(params)
+            return profile.add_to(metrics_dict)
+    except Exception:
+        pass
+    return None
+
+
+def smart_tune_dbscan(X, n_trials=N_TRIALS, sample_size=SAMPLE_SIZE, random_state=42,
+                      eps_range=EPS_RANGE, precompute_graph=True):
+    """
+    Randomized DBSCAN tuner:
+    - Picks random eps, min_samples, metric, algorithm, leaf_size
+    - Trains only on a sample
+    - Ignores results with negative or None silhouette
+    - precompute_graph: build one radius-neighbour graph per metric at the
+      largest eps and cut every trial out of it (graph_dbscan).
+      algorithm / leaf_size only affect speed, so they are still drawn and
+      recorded (for the final refit) but not used per trial. Combinations
+      the tree cannot handle (e.g. cosine) are skipped, as the direct fit
+      rejects them too.
+    """
+    X_used, trials, _, settings = plan_dbscan(X, n_trials, sample_size, random_state, eps_range)
+
+    evaluator = ClusterEvaluator(X_used)  # distances computed once for all trials
+    graphs = {} if precompute_graph else None
+    results = []
+
+    for params in tqdm(trials, desc="Smart DBSCAN Tuning"):
+        metrics_dict = run_dbscan_trial(X_used, evaluator, params, graphs, eps_max=settings["eps_range"][1])
+        if metrics_dict is not None:
+            results.append(metrics_dict)
 
     return results
@@ -1,12 +1,174 @@
 # models/gmm_model.py
 
 from sklearn.mixture import GaussianMixture
-from utils.evaluation import evaluate_model
+from utils.evaluation import ClusterEvaluator, sample_rows
+from utils.profiling import TrialProfile
 from tqdm import tqdm
 import numpy as np
 
+COV_TYPES = ["full", "tied", "diag", "spherical"]
+CLUSTER_RANGE = (2, 10)
+SAMPLE_SIZE = 10000
 
-def tune_gmm(X, cluster_range=(2, 10), sample_size=10000, random_state=42, cov_types=None):
+
+def plan_gmm(X, cluster_range=CLUSTER_RANGE, sample_size=SAMPLE_SIZE, random_state=42, cov_types=None,
+             mode="grid", top_n=5, criterion="bic"):
+    """
+    (X_used, trials, groups, settings) for tune_gmm's grid, in its row order.
+    Grid trials are independent (one group each); the warm search is one
+    group, since the k chains and the shortlist need the whole sweep.
+    """
+    if cov_types is None:
+        cov_types = COV_TYPES
+    X_used = sample_rows(X, sample_size, random_state)
+    ks = list(range(cluster_range[0], cluster_range[1] + 1))
+    trials = [{"n_components": k, "covariance_type": cov} for k in ks for cov in cov_types]
+    settings = {"random_state": random_state, "mode": mode}
+    if mode == "warm":
+        settings.update({"ks": ks, "cov_types": list(cov_types), "top_n": top_n, "criterion": criterion})
+        return X_used, trials, [list(range(len(trials)))], settings
+    return X_used, trials, [[i] for i in range(len(trials))], settings
+
+
+def run_gmm_trial(X_used, evaluator, k, cov, random_state=42):
+    """Metrics dict for one (n_components, covariance_type); failures are recorded, not raised."""
+    profile = TrialProfile(X_used)
+    try:
+        with profile:
+            with profile.phase("fit"):
+                model = GaussianMixture(
+                    n_components=k,
+                    covariance_type=cov,
+                    random_state=random_state,
+                    n_init=2
+                )
+                labels = model.fit_predict(X_used)
+            with profile.phase("eval"):
+                metrics = evaluator.evaluate(labels)
+        metrics["params"] = {"n_components": k, "covariance_type": cov}
+        metrics["n_iter"] = model.n_iter_
+        metrics["converged"] = model.converged_
+        return profile.add_to(metrics)
+    except Exception as e:
+        return profile.add_to(_failed(k, cov, e))
+
+
+def _failed(k, cov, e):
+    return {
+        "silhouette": None,
+        "davies_bouldin": None,
+        "calinski_harabasz": None,
+        "params": {"n_components": k, "covariance_type": cov},
+        "note": f"Failed with error: {str(e)}"
+    }
+
+
+def split_init(model):
+    """
+    (weights, means, precisions) for k+1 components from a fitted k-component
+    model: the heaviest component is split in two along its principal axis.
+    """
+    j = int(np.argmax(model.weights_))
+    d = model.means_.shape[1]
+    cov_type = model.covariance_type
+    if cov_type == "full":
+        cov = model.covariances_[j]
+    elif cov_type == "tied":
+        cov = model.covariances_
+    elif cov_type == "diag":
+        cov = np.diag(model.covariances_[j])
+    else:
+        cov = np.eye(d) * model.covariances_[j]
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    shift = 0.5 * np.sqrt(max(eigvals[-1], 0.0)) * eigvecs[:, -1]
+
+    weights = np.append(model.weights_, model.weights_[j] / 2)
+    weights[j] /= 2
+    means = np.vstack([model.means_, model.means_[j] - shift])
+    means[j] = model.means_[j] + shift
+    if cov_type == "tied":
+        precisions = model.precisions_
+    else:
+        precisions = np.concatenate([model.precisions_, model.precisions_[j:j + 1]])
+    return weights, means, precisions
+
+
+def warm_gmm_search(X_used, evaluator, ks, cov_types, random_state=42, top_n=5, criterion="bic"):
+    """
+    For each covariance type, fit the smallest k cold (n_init=2) and every
+    next k warm-started from the k-1 solution (split_init). All fits are
+    ranked by criterion ("bic" or "aic", lower is better) and only the
+    top_n get the silhouette / DB / CH evaluation; the rest are returned
+    with None metrics and a note. Every row reports bic, aic, n_iter,
+    converged and warm_start. Rows come back in tune_gmm's grid order.
+    """
+    fits = {}
+    for cov in cov_types:
+        prev = None
+        for k in ks:
+            profile = TrialProfile(X_used)
+            try:
+                with profile, profile.phase("fit"):
+                    if prev is None:
+                        model = GaussianMixture(
+                            n_components=k, covariance_type=cov, random_state=random_state, n_init=2
+                        )
+                    else:
+                        weights, means, precisions = split_init(prev)
+                        model = GaussianMixture(
+                            n_components=k, covariance_type=cov, random_state=random_state,
+                            weights_init=weights, means_init=means, precisions_init=precisions
+                        )
+                    labels = model.fit_predict(X_used)
+                    bic, aic = model.bic(X_used), model.aic(X_used)
+                fits[(k, cov)] = {
+                    "labels": labels,
+                    "bic": bic,
+                    "aic": aic,
+                    "n_iter": model.n_iter_,
+                    "converged": model.converged_,
+                    "warm_start": prev is not None,
+                    "profile": profile,
+                }
+                prev = model
+            except Exception as e:
+                fits[(k, cov)] = {"error": e, "profile": profile}
+                prev = None  # next k starts cold
+
+    ranked = sorted((key for key, fit in fits.items() if "error" not in fit), key=lambda key: fits[key][criterion])
+    shortlist = set(ranked[:top_n])
+
+    results = []
+    for k in ks:
+        for cov in cov_types:
+            fit = fits[(k, cov)]
+            profile = fit["profile"]
+            if "error" in fit:
+                results.append(profile.add_to(_failed(k, cov, fit["error"])))
+                continue
+            try:
+                if (k, cov) in shortlist:
+                    with profile, profile.phase("eval"):
+                        metrics = evaluator.evaluate(fit["labels"])
+                else:
+                    metrics = {
+                        "silhouette": None,
+                        "davies_bouldin": None,
+                        "calinski_harabasz": None,
+                        "note": f"Not evaluated (outside top {top_n} by {criterion.upper()})"
+                    }
+            except Exception as e:
+                results.append(profile.add_to(_failed(k, cov, e)))
+                continue
+            metrics["params"] = {"n_components": k, "covariance_type": cov}
+            for name in ["bic", "aic", "n_iter", "converged", "warm_start"]:
+                metrics[name] = fit[name]
+            results.append(profile.add_to(metrics))
+    return results
+
+
+def tune_gmm(X, cluster_range=CLUSTER_RANGE, sample_size=SAMPLE_SIZE, random_state=42, cov_types=None,
+             mode="grid", top_n=5, criterion="bic"):
     """
     Grid search for Gaussian Mixture Models (GMM).
     Parameters:
@@ -20,41 +182,22 @@ def tune_gmm(X, cluster_range=(2, 10), sample_size=10000, random_state=42, cov_t
             Random seed for reproducibility.
         cov_types : list
             List of covariance types to test. Default: ["full", "tied", "diag", "spherical"].
+        mode : str
+            "grid": cold fit (n_init=2) and full evaluation of every pair.
+            "warm": warm_gmm_search, k warm-started from k-1 and only the
+            top_n fits by criterion ("bic" / "aic") fully evaluated.
     """
-    if cov_types is None:
-        cov_types = ["full", "tied", "diag", "spherical"]
-
-    # Sampling
-    if len(X) > sample_size:
-        rng = np.random.RandomState(random_state)
-        idx = rng.choice(len(X), size=sample_size, replace=False)
-        X_used = X[idx]
-    else:
-        X_used = X
+    X_used, trials, _, settings = plan_gmm(
+        X, cluster_range, sample_size, random_state, cov_types, mode, top_n, criterion
+    )
+    evaluator = ClusterEvaluator(X_used)  # distances computed once for all trials
 
-    results = []
-    total = (cluster_range[1] - cluster_range[0] + 1) * len(cov_types)
+    if mode == "warm":
+        return warm_gmm_search(
+            X_used, evaluator, settings["ks"], settings["cov_types"], random_state, top_n, criterion
+        )
 
-    for k in tqdm(range(cluster_range[0], cluster_range[1] + 1), desc="GMM Tuning"):
-        for cov in cov_types:
-            try:
-                model = GaussianMixture(
-                    n_components=k,
-                    covariance_type=cov,
-                    random_state=random_state,
-                    n_init=2
-                )
-                labels = model.fit_predict(X_used)
-                metrics = evaluate_model(X_used, labels)
-                metrics["params"] = {"n_components": k, "covariance_type": cov}
-                results.append(metrics)
-            except Exception as e:
-                results.append({
-                    "silhouette": None,
-                    "davies_bouldin": None,
-                    "calinski_harabasz": None,
-                    "params": {"n_components": k, "covariance_type": cov},
-                    "note": f"Failed with error: {str(e)}"
-                })
-
-    return results
+    return [
+        run_gmm_trial(X_used, evaluator, p["n_components"], p["covariance_type"], random_state)
+        for p in tqdm(trials, desc="GMM Tuning")
+    ]
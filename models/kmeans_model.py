@@ -1,59 +1,47 @@
 import numpy as np
 import pandas as pd
 from sklearn.cluster import KMeans
-from sklearn.metrics import (
-    silhouette_score,
-    davies_bouldin_score,
-    calinski_harabasz_score,
-)
+from sklearn.preprocessing import StandardScaler
 from joblib import Parallel, delayed
 from tqdm import tqdm
 
-
-# ======================================================
-# Fast evaluation function (sampled silhouette)
-# ======================================================
-def evaluate_model_fast(X, labels, sample_size=2000, random_state=42):
-    try:
-        sil = silhouette_score(X, labels, sample_size=sample_size, random_state=random_state)
-    except Exception:
-        sil = None
-    try:
-        db = davies_bouldin_score(X, labels)
-    except Exception:
-        db = None
-    try:
-        ch = calinski_harabasz_score(X, labels)
-    except Exception:
-        ch = None
-    return {"silhouette": sil, "davies_bouldin": db, "calinski_harabasz": ch}
+from utils.preprocessing import slice_scaler, fit_pca
+from utils.evaluation import ClusterEvaluator, evaluate_model_fast  # evaluate_model_fast still importable from here
+from utils.profiling import TrialProfile
 
 
 # ======================================================
 # Parallelized KMeans tuning (with progress bar)
 # ======================================================
 def tune_kmeans_fast(X, cluster_range=(5, 10), random_state=42, n_jobs=-1):
+    # evaluate_model_fast semantics: sampled silhouette, failures become None
+    evaluator = ClusterEvaluator(X, sample_size=None, silhouette_sample=2000)
+
     def run_kmeans(k):
+        profile = TrialProfile(X)
         try:
-            model = KMeans(
-                n_clusters=k,
-                n_init=10,
-                max_iter=300,
-                init="k-means++",
-                random_state=random_state,
-            )
-            labels = model.fit_predict(X)
-            metrics = evaluate_model_fast(X, labels)
+            with profile:
+                with profile.phase("fit"):
+                    model = KMeans(
+                        n_clusters=k,
+                        n_init=10,
+                        max_iter=300,
+                        init="k-means++",
+                        random_state=random_state,
+                    )
+                    labels = model.fit_predict(X)
+                with profile.phase("eval"):
+                    metrics = evaluator.evaluate(labels, strict=False)
             metrics["params"] = {"n_clusters": k}
-            return metrics
+            return profile.add_to(metrics)
         except Exception as e:
-            return {
+            return profile.add_to({
                 "silhouette": None,
                 "davies_bouldin": None,
                 "calinski_harabasz": None,
                 "params": {"n_clusters": k},
                 "note": f"Failed with error: {str(e)}",
-            }
+            })
 
     results = Parallel(n_jobs=n_jobs)(
         delayed(run_kmeans)(k)
@@ -68,50 +56,68 @@ def tune_kmeans_fast(X, cluster_range=(5, 10), random_state=42, n_jobs=-1):
 def search_feature_subsets(
     df,
     features,
-    preprocess_data,
     sample_size=10000,
     n_subsets=30,
     cluster_range=(5, 10),
     random_state=42,
+    variance_threshold=0.8,
+    return_index=False,
 ):
+    """
+    Random feature-subset search for KMeans.
+
+    All candidate features are standardised once; each subset slices its
+    columns from that matrix, takes its row sample, and fits PCA on the
+    sample only. Subsets drawn more than once reuse the first result.
+    return_index=True also returns the df row positions of best_X_sample.
+    """
     rng = np.random.RandomState(random_state)
     best_score = -1
     best_features = features
     subset_results = []
+    seen = {}
 
     print(f"\n=== Searching {n_subsets} random feature subsets for KMeans ===")
 
+    # Standardise the full matrix once
+    scaler_full = StandardScaler()
+    X_std = scaler_full.fit_transform(df[list(features)])
+
     for _ in tqdm(range(n_subsets), desc="Feature subset search"):
         k = rng.randint(5, len(features) + 1)  # subset size
         subset = rng.choice(features, size=k, replace=False)
 
-        # Preprocess with PCA
-        X_sub, scaler_sub, pca_sub = preprocess_data(
-            df, list(subset), use_pca=True, variance_threshold=0.8
-        )
+        # Downsample if too large (drawn every iteration to keep the RNG stream stable)
+        idx = rng.choice(len(X_std), size=sample_size, replace=False) if len(X_std) > sample_size else None
+
+        key = tuple(sorted(subset))
+        if key in seen:
+            subset_results.append({"features": subset, "best_silhouette": seen[key]})
+            continue
 
-        # Downsample if too large
-        if len(X_sub) > sample_size:
-            idx = rng.choice(len(X_sub), size=sample_size, replace=False)
-            X_sample = X_sub[idx]
-        else:
-            X_sample = X_sub
+        cols = [list(features).index(f) for f in subset]
+        X_sample_std = X_std[idx][:, cols] if idx is not None else X_std[:, cols]
+        X_sample, pca_sub = fit_pca(X_sample_std, variance_threshold=variance_threshold)
 
         # Tune KMeans
         res = tune_kmeans_fast(X_sample, cluster_range=cluster_range, random_state=random_state, n_jobs=-1)
         df_res = pd.DataFrame(res)
         top_model = df_res.loc[df_res["silhouette"].idxmax()]
 
+        seen[key] = top_model["silhouette"]
         subset_results.append({"features": subset, "best_silhouette": top_model["silhouette"]})
 
         if top_model["silhouette"] and top_model["silhouette"] > best_score:
             best_score = top_model["silhouette"]
             best_features = subset
             best_scaler, best_pca, best_X_sample, best_params = (
-                scaler_sub,
+                slice_scaler(scaler_full, features, subset),
                 pca_sub,
                 X_sample,
                 top_model["params"],
             )
+            best_index = idx if idx is not None else np.arange(len(X_std))
 
+    if return_index:
+        return best_features, best_score, best_scaler, best_pca, best_X_sample, best_params, subset_results, best_index
     return best_features, best_score, best_scaler, best_pca, best_X_sample, best_params, subset_results
@@ -1,20 +1,112 @@
 # models/spectral_model.py
 
-from sklearn.cluster import SpectralClustering
-from utils.evaluation import evaluate_model
+from sklearn.cluster import SpectralClustering, k_means
+from sklearn.manifold import spectral_embedding
+from sklearn.neighbors import kneighbors_graph
+from sklearn.metrics.pairwise import rbf_kernel
+from utils.evaluation import ClusterEvaluator, sample_rows
+from utils.profiling import TrialProfile
 from tqdm import tqdm
 import numpy as np
 
+try:
+    from sklearn.cluster._spectral import discretize, cluster_qr
+except ImportError:  # private helpers, only needed for non-kmeans assign_labels
+    discretize = cluster_qr = None
+
+
+def spectral_maps(X, affinity, n_components, n_neighbors=10, gamma=1.0, random_state=42):
+    """
+    Leading n_components eigenvectors of the normalised Laplacian, built
+    the same way SpectralClustering does. The kNN affinity stays sparse and
+    goes through the ARPACK (sparse) eigensolver.
+    """
+    if affinity == "nearest_neighbors":
+        connectivity = kneighbors_graph(X, n_neighbors=n_neighbors, include_self=True)
+        affinity_matrix = 0.5 * (connectivity + connectivity.T)
+    elif affinity == "rbf":
+        affinity_matrix = rbf_kernel(X, gamma=gamma)
+    else:
+        raise ValueError(f"Unsupported affinity: {affinity}")
+    return spectral_embedding(
+        affinity_matrix,
+        n_components=n_components,
+        eigen_solver="arpack",
+        random_state=random_state,
+        drop_first=False,
+    )
+
+
+def assign_spectral_labels(maps, k, assign_labels="kmeans", random_state=42, n_init=10):
+    """Label assignment step of SpectralClustering on the first k eigenvectors."""
+    maps = maps[:, :k]
+    if assign_labels == "kmeans":
+        _, labels, _ = k_means(maps, k, random_state=random_state, n_init=n_init)
+        return labels
+    if assign_labels == "cluster_qr" and cluster_qr is not None:
+        return cluster_qr(maps)
+    if assign_labels == "discretize" and discretize is not None:
+        return discretize(maps, random_state=random_state)
+    raise ValueError(f"Unsupported assign_labels: {assign_labels}")
+
+
+CLUSTER_RANGE = (3, 10)
+SAMPLE_SIZE = 6000  # smaller sample for faster tuning
+AFFINITY_METHODS = ["nearest_neighbors", "rbf"]
+N_NEIGHBORS_LIST = [10, 15]
+GAMMA_LIST = [0.5, 1.0]
+ASSIGN_LABELS_LIST = ["kmeans"]
+
+
+def spectral_settings(affinity_methods, n_neighbors_list, gamma_list):
+    """(affinity, parameter name, value) for each affinity setting in the grid."""
+    settings = []
+    for affinity in affinity_methods:
+        if affinity == "nearest_neighbors":
+            settings += [(affinity, "n_neighbors", v) for v in n_neighbors_list]
+        elif affinity == "rbf":
+            settings += [(affinity, "gamma", v) for v in gamma_list]
+    return settings
+
+
+def plan_spectral(X, cluster_range=CLUSTER_RANGE, sample_size=SAMPLE_SIZE, random_state=42, affinity_methods=None,
+                  n_neighbors_list=None, gamma_list=None, assign_labels_list=None):
+    """
+    (X_used, trials, groups, settings) for tune_spectral's grid, in its row
+    order. groups holds the trial indices sharing one spectral embedding (one
+    affinity setting); utils/tuning.py runs each group as one pool task.
+    """
+    affinity_methods = AFFINITY_METHODS if affinity_methods is None else affinity_methods
+    n_neighbors_list = N_NEIGHBORS_LIST if n_neighbors_list is None else n_neighbors_list
+    gamma_list = GAMMA_LIST if gamma_list is None else gamma_list
+    assign_labels_list = ASSIGN_LABELS_LIST if assign_labels_list is None else assign_labels_list
+
+    X_used = sample_rows(X, sample_size, random_state)
+    ks = range(cluster_range[0], cluster_range[1] + 1)
+    settings = spectral_settings(affinity_methods, n_neighbors_list, gamma_list)
+    trials = [
+        {"n_clusters": k, "affinity": affinity, name: value, "assign_labels": assign_labels}
+        for k in ks
+        for affinity, name, value in settings
+        for assign_labels in assign_labels_list
+    ]
+    groups = [
+        [i for i, t in enumerate(trials) if t["affinity"] == affinity and t.get(name) == value]
+        for affinity, name, value in settings
+    ]
+    return X_used, trials, groups, {"n_components": max(ks), "random_state": random_state}
+
 
 def tune_spectral(
     X,
-    cluster_range=(3, 10),
-    sample_size=6000,  # smaller sample for faster tuning
+    cluster_range=CLUSTER_RANGE,
+    sample_size=SAMPLE_SIZE,
     random_state=42,
     affinity_methods=None,
     n_neighbors_list=None,
     gamma_list=None,
-    assign_labels_list=None
+    assign_labels_list=None,
+    shared_embedding=True
 ):
     """
     Optimized Grid Search for Spectral Clustering (faster version).
@@ -35,84 +127,94 @@ def tune_spectral(
             Default: [0.5, 1.0] for rbf
         assign_labels_list : list
             Default: ["kmeans"]
+        shared_embedding : bool
+            Compute the affinity and its leading max(k) eigenvectors once per
+            (affinity, gamma / n_neighbors) and rerun only the label
+            assignment for each k and assign method. False refits
+            SpectralClustering for every combination.
     """
-    if affinity_methods is None:
-        affinity_methods = ["nearest_neighbors", "rbf"]
-    if n_neighbors_list is None:
-        n_neighbors_list = [10, 15]
-    if gamma_list is None:
-        gamma_list = [0.5, 1.0]
-    if assign_labels_list is None:
-        assign_labels_list = ["kmeans"]
+    X_used, trials, groups, settings = plan_spectral(
+        X, cluster_range, sample_size, random_state, affinity_methods,
+        n_neighbors_list, gamma_list, assign_labels_list
+    )
+    evaluator = ClusterEvaluator(X_used)  # distances computed once for all trials
 
-    # =============================
-    # Sample data for faster tuning
-    # =============================
-    if len(X) > sample_size:
-        rng = np.random.RandomState(random_state)
-        idx = rng.choice(len(X), size=sample_size, replace=False)
-        X_used = X[idx]
-    else:
-        X_used = X
-
-    results = []
+    if shared_embedding:
+        by_index = {}
+        for group in tqdm(groups, desc="Spectral Tuning (shared embedding)"):
+            first = trials[group[0]]
+            name = "gamma" if first["affinity"] == "rbf" else "n_neighbors"
+            pairs = [(trials[i]["n_clusters"], trials[i]["assign_labels"]) for i in group]
+            scored = run_spectral_setting(
+                X_used, evaluator, first["affinity"], name, first[name], pairs,
+                settings["n_components"], random_state
+            )
+            for i, pair in zip(group, pairs):
+                by_index[i] = scored[pair]
+        # Same row order as the per-fit grid
+        return [by_index[i] for i in range(len(trials))]
 
     # =============================
     # Grid Search
     # =============================
-    for k in tqdm(range(cluster_range[0], cluster_range[1] + 1), desc="Spectral Tuning"):
-        for affinity in affinity_methods:
-            try:
-                if affinity == "nearest_neighbors":
-                    for n_neighbors in n_neighbors_list:
-                        for assign_labels in assign_labels_list:
-                            model = SpectralClustering(
-                                n_clusters=k,
-                                affinity=affinity,
-                                n_neighbors=n_neighbors,
-                                assign_labels=assign_labels,
-                                random_state=random_state,
-                                n_init=10
-                            )
-                            labels = model.fit_predict(X_used)
-                            metrics = evaluate_model(X_used, labels)
-                            metrics["params"] = {
-                                "n_clusters": k,
-                                "affinity": affinity,
-                                "n_neighbors": n_neighbors,
-                                "assign_labels": assign_labels
-                            }
-                            results.append(metrics)
-                elif affinity == "rbf":
-                    for gamma in gamma_list:
-                        for assign_labels in assign_labels_list:
-                            model = SpectralClustering(
-                                n_clusters=k,
-                                affinity=affinity,
-                                gamma=gamma,
-                                assign_labels=assign_labels,
-                                random_state=random_state,
-                                n_init=10
-                            )
-                            labels = model.fit_predict(X_used)
-                            metrics = evaluate_model(X_used, labels)
-                            metrics["params"] = {
-                                "n_clusters": k,
-                                "affinity": affinity,
-                                "gamma": gamma,
-                                "assign_labels": assign_labels
-                            }
-                            results.append(metrics)
-            except Exception as e:
-                results.append({
-                    "silhouette": None,
-                    "davies_bouldin": None,
-                    "calinski_harabasz": None,
-                    "params": {
-                        "n_clusters": k,
-                        "affinity": affinity
-                    },
-                    "note": f"Failed with error: {str(e)}"
-                })
+    results = []
+    for params in tqdm(trials, desc="Spectral Tuning"):
+        profile = TrialProfile(X_used)
+        try:
+            with profile:
+                with profile.phase("fit"):
+                    model = SpectralClustering(**params, random_state=random_state, n_init=10)
+                    labels = model.fit_predict(X_used)
+                with profile.phase("eval"):
+                    metrics = evaluator.evaluate(labels)
+            metrics["params"] = dict(params)
+        except Exception as e:
+            metrics = {
+                "silhouette": None,
+                "davies_bouldin": None,
+                "calinski_harabasz": None,
+                "params": dict(params),
+                "note": f"Failed with error: {str(e)}"
+            }
+        results.append(profile.add_to(metrics))
 
     return results
+
+
+def run_spectral_setting(X_used, evaluator, affinity, name, value, pairs, n_components, random_state=42):
+    """
+    {(k, assign_labels): metrics dict} for every pair on one shared
+    embedding with n_components eigenvectors (max k of the whole grid, so
+    the result does not depend on which pairs are asked for).
+    """
+    embedding = TrialProfile(X_used)  # shared by every pair
+    try:
+        with embedding, embedding.phase("fit"):
+            maps = spectral_maps(
+                X_used, affinity, n_components=n_components, random_state=random_state, **{name: value}
+            )
+    except Exception as e:
+        maps, error = None, e
+    out = {}
+    for k, assign_labels in pairs:
+        params = {"n_clusters": k, "affinity": affinity, name: value, "assign_labels": assign_labels}
+        profile = TrialProfile(X_used, shared=embedding)
+        try:
+            if maps is None:
+                raise error
+            with profile:
+                with profile.phase("fit"):
+                    labels = assign_spectral_labels(maps, k, assign_labels, random_state=random_state)
+                with profile.phase("eval"):
+                    metrics = evaluator.evaluate(labels)
+            metrics["params"] = params
+        except Exception as e:
+            metrics = {
+                "silhouette": None,
+                "davies_bouldin": None,
+                "calinski_harabasz": None,
+                "params": params,
+                "note": f"Failed with error: {str(e)}"
+            }
+        out[(k, assign_labels)] = profile.add_to(metrics)
+    return out
@@ -33,7 +33,7 @@ export default function HomePage() {
       setLoading(true)
       setError(null)
       try {
-        const response = await axios.get(`${API_URL}/clusters?random_sample=false`)
+        const response = await axios.get(`${API_URL}/clusters?fields=id,name,artists,album_art,preview_url`)
         const fetchedSongs: Song[] = response.data.songs.map((song: any) => {
           const artists = Array.isArray(song.artists)
             ? song.artists.join(", ")
@@ -37,7 +37,7 @@ function RecommendationsContent() {
 
       try {
         // Fetch all songs to ensure selected song exists
-        const songResponse = await axios.get("http://localhost:8000/clusters?random_sample=false")
+        const songResponse = await axios.get("http://localhost:8000/clusters?fields=id,name,artists,album_art,preview_url")
         const songs = songResponse.data.songs
         const song = songs.find((s: any) => String(s.id).trim() === songId)
 
@@ -1,6 +1,6 @@
 # test_recommend.py
-import pandas as pd
 from utils.recommend import get_recommendations
+from utils.storage import read_dataset
 
 # =============================
 # Choose algorithm to test
@@ -18,7 +18,7 @@ CLUSTERED_PATHS = {
     "spectral": "clustered_datasets_new/spotify_spectral_sample.csv"
 }
 
-df = pd.read_csv(CLUSTERED_PATHS[ALGO])
+df = read_dataset(CLUSTERED_PATHS[ALGO])
 
 # =============================
 # Show 5 random songs to pick from
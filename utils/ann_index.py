@@ -0,0 +1,311 @@
+# utils/ann_index.py
+"""
+Nearest-neighbour indexes over the L2-normalised catalog embeddings.
+
+Every index implements build / save / load / query and stores plain .npy
+arrays plus a meta.json, so the serving side can memory-map them.
+
+    - ExactIndex: brute-force dot product, the reference for recall checks
+    - IVFIndex:   inverted file over KMeans centroids; only the n_probe lists
+                  closest to the query are scanned (n_probe is the
+                  recall/latency knob)
+
+Songs ingested at serving time go through extended(), which leaves the
+saved (memory-mapped) arrays alone and keeps the new vectors in a small
+in-memory BufferedIndex that is scanned exactly next to the base. The
+buffer only grows until the next offline build folds those songs in.
+"""
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from sklearn.cluster import KMeans
+
+from utils.artifacts import CLUSTERED_PATHS, embedding_paths, index_path
+
+logger = logging.getLogger(__name__)
+
+
+def ids_digest(ids):
+    """Stable fingerprint of a catalog's id order, stored with each index."""
+    h = hashlib.sha1()
+    for tid in ids:
+        h.update(str(tid).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first (partial sort)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def top_k_rows(scores, k):
+    """Row-wise top_k for a 2-D score matrix: (indices, scores), best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.intp), np.empty((len(scores), 0), dtype=scores.dtype)
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+# =============================
+# Exact (brute force)
+# =============================
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self):
+        self.vectors = None
+        self.meta = {}
+
+    def build(self, X, ids=None):
+        self.vectors = np.ascontiguousarray(X, dtype=np.float32)
+        self.meta = {"kind": self.kind, "n": len(X), "ids_sha1": ids_digest(ids) if ids is not None else None}
+        return self
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        index = cls()
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            index.meta = json.load(f)
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        return index
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def extended(self, X, ids=None):
+        """New index with X appended as positions len(self)... (see BufferedIndex)."""
+        return BufferedIndex(self).extended(X, ids)
+
+    def query(self, q, k, n_probe=None):
+        """Return (catalog positions, scores) of the k best matches for q (n_probe is ignored)."""
+        scores = self.vectors @ np.asarray(q, dtype=np.float32)
+        best = top_k(scores, k)
+        return best, scores[best]
+
+
+# =============================
+# IVF (inverted file)
+# =============================
+class IVFIndex:
+    """
+    Vectors are grouped by their nearest centroid and stored list by list,
+    so scanning a list is one contiguous (memory-mapped) slice.
+
+    Centroids can be passed in (e.g. cluster_centers_ of the KMeans model
+    trained in main.py) or trained here with the same k-means++ setup as
+    models/kmeans_model.py.
+    """
+    kind = "ivf"
+
+    def __init__(self, n_probe=8):
+        self.n_probe = n_probe
+        self.centroids = None
+        self.vectors = None
+        self.positions = None
+        self.offsets = None
+        self.meta = {}
+
+    def build(self, X, ids=None, centroids=None, n_lists=None, train_size=50000, random_state=42):
+        X = np.asarray(X, dtype=np.float32)
+        if centroids is None:
+            n_lists = n_lists or max(1, int(np.sqrt(len(X))))
+            rng = np.random.RandomState(random_state)
+            train = X[rng.choice(len(X), size=train_size, replace=False)] if len(X) > train_size else X
+            centroids = KMeans(
+                n_clusters=n_lists, n_init=1, max_iter=100, init="k-means++", random_state=random_state
+            ).fit(train).cluster_centers_
+        centroids = np.asarray(centroids, dtype=np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = centroids / norms
+
+        assign = np.empty(len(X), dtype=np.int32)
+        for start in range(0, len(X), 100_000):
+            assign[start:start + 100_000] = np.argmax(X[start:start + 100_000] @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+
+        self.centroids = centroids
+        self.vectors = np.ascontiguousarray(X[order])
+        self.positions = order.astype(np.int32)
+        self.offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1)).astype(np.int64)
+        self.meta = {
+            "kind": self.kind,
+            "n": len(X),
+            "n_lists": len(centroids),
+            "n_probe": self.n_probe,
+            "ids_sha1": ids_digest(ids) if ids is not None else None,
+        }
+        return self
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ["centroids", "vectors", "positions", "offsets"]:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        index = cls(n_probe=meta.get("n_probe", 8))
+        index.meta = meta
+        mode = "r" if mmap else None
+        index.centroids = np.load(os.path.join(path, "centroids.npy"))
+        index.offsets = np.load(os.path.join(path, "offsets.npy"))
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode)
+        index.positions = np.load(os.path.join(path, "positions.npy"), mmap_mode=mode)
+        return index
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def extended(self, X, ids=None):
+        """New index with X appended as positions len(self)... (see BufferedIndex)."""
+        return BufferedIndex(self).extended(X, ids)
+
+    def query(self, q, k, n_probe=None):
+        """Return (catalog positions, scores) of the k best matches found in the n_probe nearest lists."""
+        q = np.asarray(q, dtype=np.float32)
+        lists = top_k(self.centroids @ q, n_probe or self.n_probe)
+        spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists if self.offsets[l + 1] > self.offsets[l]]
+        if not spans:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        scores = np.concatenate([self.vectors[a:b] @ q for a, b in spans])
+        slots = np.concatenate([np.arange(a, b) for a, b in spans])
+        best = top_k(scores, k)
+        return np.asarray(self.positions[slots[best]]), scores[best]
+
+
+# =============================
+# Base index + songs appended at serving time
+# =============================
+class BufferedIndex:
+    """
+    A saved index plus vectors appended after it was built, as positions
+    len(base)... The base is never copied (it stays memory-mapped); the
+    buffer is scanned exactly and merged with the base's top k, so each
+    extension costs O(buffer) instead of O(catalog).
+    """
+
+    def __init__(self, base, vectors=None, meta=None):
+        self.base = base
+        self.vectors = np.empty((0, base.vectors.shape[1]), dtype=np.float32) if vectors is None else vectors
+        self.meta = meta or dict(base.meta)
+
+    @property
+    def kind(self):
+        return self.base.kind
+
+    def __len__(self):
+        return len(self.base) + len(self.vectors)
+
+    def extended(self, X, ids=None):
+        """
+        New index with X appended; self is left untouched for its readers.
+        ids (all of them, for meta) is optional: a buffered index is never saved.
+        """
+        vectors = np.concatenate([self.vectors, np.asarray(X, dtype=np.float32)])
+        n = len(self.base) + len(vectors)
+        meta = {**self.meta, "n": n, "ids_sha1": ids_digest(ids) if ids is not None else None}
+        return BufferedIndex(self.base, vectors, meta)
+
+    def query(self, q, k, n_probe=None):
+        """Return (catalog positions, scores) of the k best matches in the base and the buffer."""
+        q = np.asarray(q, dtype=np.float32)
+        found, scores = self.base.query(q, k, n_probe=n_probe)
+        extra = self.vectors @ q
+        best = top_k(extra, k)
+        found = np.concatenate([np.asarray(found, dtype=np.int64), best + len(self.base)])
+        scores = np.concatenate([scores, extra[best]])
+        best = top_k(scores, k)
+        return found[best], scores[best]
+
+
+INDEX_TYPES = {
+    ExactIndex.kind: ExactIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def build_index(X, kind="ivf", ids=None, **kwargs):
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index kind: {kind}")
+    if kind == IVFIndex.kind:
+        n_probe = kwargs.pop("n_probe", 8)
+        return IVFIndex(n_probe=n_probe).build(X, ids=ids, **kwargs)
+    return INDEX_TYPES[kind]().build(X, ids=ids)
+
+
+def load_index(path, mmap=True):
+    """Load whichever index type is saved at path (memory-mapped by default)."""
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        kind = json.load(f)["kind"]
+    return INDEX_TYPES[kind].load(path, mmap=mmap)
+
+
+def recall_at_k(index, X, k=10, n_queries=200, random_state=42, **query_kwargs):
+    """Fraction of exact top-k neighbours the index returns, on sampled catalog queries."""
+    exact = ExactIndex().build(X)
+    rng = np.random.RandomState(random_state)
+    queries = rng.choice(len(X), size=min(n_queries, len(X)), replace=False)
+    hits = 0
+    for qi in queries:
+        truth, _ = exact.query(X[qi], k)
+        found, _ = index.query(X[qi], k, **query_kwargs)
+        hits += len(np.intersect1d(truth, found))
+    return hits / (len(queries) * k)
+
+
+# =============================
+# Offline build (main.py stage)
+# =============================
+def build_all_indexes(kind="ivf", algos=None, min_rows=50000, **kwargs):
+    """
+    Build an index for every catalog whose embeddings exist (see
+    utils/embeddings.py). Catalogs smaller than min_rows are skipped: an
+    exact scan is already fast there and stays exact.
+    """
+    built = {}
+    for algo in (algos or CLUSTERED_PATHS):
+        emb_path, ids_path = embedding_paths(algo)
+        if not os.path.exists(emb_path):
+            logger.warning(f"Skipping {algo}: no embeddings at {emb_path}")
+            continue
+        X = np.load(emb_path, mmap_mode="r")
+        if len(X) < min_rows:
+            logger.info(f"Skipping {algo}: {len(X)} rows < min_rows={min_rows}, exact scan is used")
+            continue
+        index = build_index(np.asarray(X), kind=kind, ids=np.load(ids_path), **dict(kwargs))
+        index.save(index_path(algo))
+        logger.info(f"Saved {kind} index for {algo} ({len(index)} rows) to {index_path(algo)}")
+        built[algo] = index_path(algo)
+    return built
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_all_indexes()
@@ -0,0 +1,66 @@
+# =============================
+# Artifact locations shared by main.py, offline steps and serving
+# =============================
+import os
+
+FEATURES_PATH = "saved_models/kmeans/best_features.json"
+SCALER_PATH = "saved_models/kmeans/scaler_sample_features.joblib"
+PCA_PATH = "saved_models/kmeans/pca_sample_features.joblib"
+
+# Full track catalog and the classifier that carries spectral labels to it
+CATALOG_PATH = "data/spotify_tracks_clean.csv"
+SPECTRAL_CLASSIFIER_PATH = "saved_models/spectral_classifier/spectral_classifier.joblib"
+SPECTRAL_SCALER_PATH = "saved_models/spectral_classifier/scaler_sample_features.joblib"
+SPECTRAL_PCA_PATH = "saved_models/spectral_classifier/pca_sample_features.joblib"
+ASSIGNER_PATH = "saved_models/spectral_classifier/nearest_centroid.npz"  # distilled classifier
+
+# Final models that can label new tracks directly (fitted on the PCA sample)
+CLUSTER_MODEL_PATHS = {
+    "kmeans": "saved_models/kmeans/kmeans_best_model_sample_features.joblib",
+    "gmm": "saved_models/gmm/gmm_best_model_sample.joblib",
+}
+
+# =============================
+# Clustered datasets per algorithm
+# =============================
+CLUSTERED_PATHS = {
+    "kmeans": "clustered_datasets_old/spotify_kmeans_sample.csv",
+    "gmm": "clustered_datasets_old/spotify_gmm_sample.csv",
+    "agglomerative": "clustered_datasets_old/spotify_agglomerative_sample.csv",
+    "dbscan": "clustered_datasets_old/spotify_dbscan_sample.csv",
+    "spectral": "clustered_datasets_new/spotify_spectral_sample.csv",
+    "spectral_full": "clustered_datasets_new/spotify_spectral_full.csv",  # classifier labels, whole catalog
+}
+
+
+def ingested_path(path):
+    """Tracks added to a clustered dataset while serving (see RecommenderEngine.ingest)."""
+    return os.path.splitext(path)[0] + "_ingested.csv"
+
+
+EMBEDDINGS_DIR = "saved_models/embeddings"
+
+
+def embedding_paths(algo):
+    """(embeddings.npy, ids.npy) for one algorithm's catalog."""
+    return (
+        os.path.join(EMBEDDINGS_DIR, f"{algo}_embeddings.npy"),
+        os.path.join(EMBEDDINGS_DIR, f"{algo}_ids.npy"),
+    )
+
+
+INDEXES_DIR = "saved_models/indexes"
+
+
+def index_path(algo):
+    """Directory holding the nearest-neighbour index for one algorithm's catalog."""
+    return os.path.join(INDEXES_DIR, algo)
+
+
+TOPK_DIR = "saved_models/topk"
+
+
+def topk_paths(algo, mode):
+    """(indices.npy, scores.npy, meta.json) of the precomputed top-K table for algo/mode."""
+    stem = os.path.join(TOPK_DIR, f"{algo}_{mode}")
+    return f"{stem}_indices.npy", f"{stem}_scores.npy", f"{stem}_meta.json"
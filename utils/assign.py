@@ -0,0 +1,68 @@
+# utils/assign.py
+"""
+Fast cluster assignment for tracks outside the catalog.
+
+The spectral RandomForest costs milliseconds per predict call. It is
+distilled into a nearest-centroid model in the forest's own input space
+(scaler + PCA folded into one affine map): each centroid is the mean
+projected training row of one forest label, so assigning is one matmul and
+an argmin. How often the centroids agree with the forest on rows neither
+of them was fitted on is measured when the model is built and saved with
+it, so callers can decide whether to trust it (utils.recommend.assign_tracks falls back to the forest below a threshold).
+"""
+import numpy as np
+
+
+class CentroidAssigner:
+    def __init__(self, centroids, classes, W, b, features, agreement=None):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.classes = np.asarray(classes)
+        self.W = np.asarray(W, dtype=np.float64)
+        self.b = np.asarray(b, dtype=np.float64)
+        self.features = [str(f) for f in features]
+        self.agreement = agreement
+        self._sq_norms = (self.centroids ** 2).sum(axis=1)
+
+    @classmethod
+    def fit(cls, clf, X, W, b, features, X_holdout=None):
+        """
+        Centroids of X (rows already projected, as the forest sees them)
+        grouped by the forest's predictions. agreement is measured on
+        X_holdout (projected the same way) when given, else on X itself,
+        which overstates it.
+        """
+        labels = clf.predict(X)
+        classes = np.unique(labels)
+        centroids = np.stack([X[labels == c].mean(axis=0) for c in classes])
+        assigner = cls(centroids, classes, W, b, features)
+        X_check = X if X_holdout is None else X_holdout
+        assigner.agreement = float(np.mean(assigner.predict_projected(X_check) == clf.predict(X_check)))
+        return assigner
+
+    def project(self, raw):
+        """Raw feature rows (in self.features order) into the forest's input space."""
+        return np.asarray(raw, dtype=np.float64) @ self.W + self.b
+
+    def predict_projected(self, Z):
+        # ||z - c||^2 up to the per-row ||z||^2, which does not change the argmin
+        dist = self._sq_norms - 2.0 * (np.atleast_2d(Z) @ self.centroids.T)
+        return self.classes[np.argmin(dist, axis=1)]
+
+    def predict(self, raw):
+        return self.predict_projected(self.project(raw))
+
+    def save(self, path):
+        np.savez(
+            path, centroids=self.centroids, classes=self.classes, W=self.W, b=self.b,
+            features=np.asarray(self.features, dtype=str),
+            agreement=np.nan if self.agreement is None else self.agreement,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            agreement = float(data["agreement"])
+            return cls(
+                data["centroids"], data["classes"], data["W"], data["b"], data["features"].tolist(),
+                agreement=None if np.isnan(agreement) else agreement,
+            )
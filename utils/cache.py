@@ -0,0 +1,93 @@
+# utils/cache.py
+"""
+Response caching for the recommender.
+
+    - LRUCache: size-bounded, optional TTL, thread-safe, with hit / miss /
+      eviction / expiration counters
+    - artifact_version: fingerprint of the files a result depends on, used
+      in cache keys so retrained artifacts never serve stale entries
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Files above this size are fingerprinted by (size, mtime) instead of content
+_CONTENT_HASH_LIMIT = 64 * 1024 * 1024
+
+
+def artifact_version(paths):
+    """Short hash over the given files; missing files are skipped."""
+    h = hashlib.sha1()
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        h.update(path.encode("utf-8"))
+        st = os.stat(path)
+        if st.st_size > _CONTENT_HASH_LIMIT:
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+            continue
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:12]
+
+
+class LRUCache:
+    def __init__(self, maxsize=4096, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
@@ -0,0 +1,113 @@
+# utils/embeddings.py
+"""
+Offline catalog embedding.
+
+StandardScaler followed by PCA is a single affine map, so it is folded into
+one (W, b) pair and applied to the whole catalog once. Rows are L2-normalised
+and stored as float32, which turns cosine similarity into a dot product.
+
+Run on its own with:  python -m utils.embeddings
+"""
+import os
+import json
+import logging
+import numpy as np
+import joblib
+
+from utils.artifacts import (
+    FEATURES_PATH, SCALER_PATH, PCA_PATH, CLUSTERED_PATHS, EMBEDDINGS_DIR, embedding_paths
+)
+from utils.storage import read_dataset, dataset_exists
+
+logger = logging.getLogger(__name__)
+
+
+def fold_affine(scaler, pca=None):
+    """
+    Collapse scaler (+ PCA) into W, b such that x @ W + b equals
+    pca.transform(scaler.transform(x)).
+    """
+    n_features = scaler.n_features_in_
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+
+    W = np.diag(1.0 / scale)
+    b = -mean / scale
+    if pca is not None:
+        W = W @ pca.components_.T
+        b = (b - pca.mean_) @ pca.components_.T
+        if getattr(pca, "whiten", False):
+            std = np.sqrt(pca.explained_variance_)
+            W, b = W / std, b / std
+    return W, b
+
+
+def embed(X, W, b, chunk_size=100_000):
+    """Project raw feature rows and L2-normalise them into a float32 matrix."""
+    X = np.asarray(X, dtype=np.float64)
+    out = np.empty((len(X), W.shape[1]), dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        Z = X[start:start + chunk_size] @ W + b
+        norms = np.linalg.norm(Z, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0  # zero vectors stay zero, like cosine_similarity
+        out[start:start + chunk_size] = Z / norms
+    return out
+
+
+def build_embeddings(dataset_path, algo, features, scaler, pca=None, stream=False):
+    """
+    Embed one clustered dataset and save embeddings + ids under EMBEDDINGS_DIR.
+    stream=True projects the dataset chunk by chunk straight into the .npy
+    memory map (stream_matrix), for catalogs too large to read at once. It
+    skips rows with missing features, so only use it on datasets that have
+    none (e.g. the label_catalog output).
+    """
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    emb_path, ids_path = embedding_paths(algo)
+    if stream:
+        from utils.preprocessing import stream_matrix  # utils.preprocessing imports this module
+
+        emb, ids = stream_matrix(dataset_path, features, scaler, pca, out_path=emb_path)
+        for start in range(0, len(emb), 100_000):
+            Z = emb[start:start + 100_000]
+            norms = np.linalg.norm(Z, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            Z /= norms
+        emb.flush()
+    else:
+        df = read_dataset(dataset_path, columns=["id"] + list(features))
+        W, b = fold_affine(scaler, pca)
+        emb = embed(df[list(features)].fillna(0).to_numpy(), W, b)
+        ids = df["id"].to_numpy(dtype=str)
+        np.save(emb_path, emb)
+    np.save(ids_path, ids)
+    logger.info(f"Saved {emb.shape} embeddings for {algo} to {emb_path}")
+    return emb_path
+
+
+def build_all_embeddings(features=None, scaler=None, pca=None, paths=None, stream=("spectral_full",)):
+    """
+    Embed every clustered dataset that exists on disk. Algorithms in stream
+    are embedded out of core (the full catalog written by label_catalog,
+    which holds complete-feature rows only).
+    """
+    if features is None:
+        with open(FEATURES_PATH, "r") as f:
+            features = json.load(f)
+    if scaler is None:
+        scaler = joblib.load(SCALER_PATH)
+    if pca is None and os.path.exists(PCA_PATH):
+        pca = joblib.load(PCA_PATH)
+
+    built = {}
+    for algo, path in (paths or CLUSTERED_PATHS).items():
+        if not dataset_exists(path):
+            logger.warning(f"Skipping {algo}: {path} not found")
+            continue
+        built[algo] = build_embeddings(path, algo, features, scaler, pca, stream=algo in stream)
+    return built
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_all_embeddings()
@@ -1,30 +1,153 @@
-from sklearn.metrics import silhouette_score, davies_bouldin_score, calinski_harabasz_score
+from sklearn.metrics import davies_bouldin_score, calinski_harabasz_score, pairwise_distances_chunked
+from sklearn.utils import check_random_state
 import numpy as np
 
-def evaluate_model(X, labels, sample_size=10000, random_state=42):
-    X = np.array(X)
-    labels = np.array(labels)
 
-    # ensure at least 2 clusters
-    if len(np.unique(labels)) < 2:
+def sample_rows(X, sample_size, random_state=42):
+    """
+    The tuners' row sample: sample_size rows drawn without replacement, or X
+    when it is small enough. random_state may be a RandomState whose stream
+    the caller keeps drawing from.
+    """
+    if len(X) > sample_size:
+        rng = check_random_state(random_state)
+        return X[rng.choice(len(X), size=sample_size, replace=False)]
+    return X
+
+
+class ClusterEvaluator:
+    """
+    Scores many label vectors against one fixed X (one tuning sweep).
+
+    The silhouette is computed from per-cluster sums of pairwise distances,
+    so the distances are never recomputed per trial: the matrix is built
+    once (float32) when it fits in max_memory_mb, otherwise it is streamed
+    in working_memory_mb chunks on each call.
+        sample_size: rows kept for every metric (same draw as evaluate_model)
+        silhouette_sample: optional smaller sample for the silhouette only
+                           (same draw as silhouette_score(sample_size=...))
+    Labels passed to the scoring methods are aligned with the X given here.
+    """
+
+    def __init__(self, X, sample_size=10000, silhouette_sample=None, random_state=42,
+                 max_memory_mb=512, working_memory_mb=64):
+        X = np.asarray(X, dtype=np.float64)
+        self.idx = None
+        if sample_size is not None and len(X) > sample_size:
+            rng = np.random.RandomState(random_state)
+            self.idx = rng.choice(len(X), size=sample_size, replace=False)
+            X = X[self.idx]
+        self.X = X
+
+        self.sil_idx = None
+        if silhouette_sample is not None:
+            rng = np.random.RandomState(random_state)
+            self.sil_idx = rng.permutation(len(X))[:silhouette_sample]
+        self.X_sil = X if self.sil_idx is None else X[self.sil_idx]
+
+        n = len(self.X_sil)
+        self.precompute = n * n * 4 <= max_memory_mb * 2**20
+        self.working_memory_mb = working_memory_mb
+        self._D = None
+
+    def _distance_blocks(self):
+        """(start_row, block) over the silhouette sample's distance matrix."""
+        if not self.precompute:
+            start = 0
+            for block in pairwise_distances_chunked(self.X_sil, working_memory=self.working_memory_mb):
+                yield start, block
+                start += len(block)
+            return
+
+        if self._D is None:
+            n = len(self.X_sil)
+            self._D = np.empty((n, n), dtype=np.float32)
+            start = 0
+            for block in pairwise_distances_chunked(self.X_sil, working_memory=self.working_memory_mb):
+                self._D[start:start + len(block)] = block
+                start += len(block)
+        step = max(1, int(self.working_memory_mb * 2**20 // (8 * len(self._D))))
+        for start in range(0, len(self._D), step):
+            yield start, self._D[start:start + step]
+
+    def _labels(self, labels):
+        labels = np.asarray(labels)
+        return labels if self.idx is None else labels[self.idx]
+
+    def silhouette(self, labels):
+        labels = self._labels(labels)
+        if self.sil_idx is not None:
+            labels = labels[self.sil_idx]
+        _, codes = np.unique(labels, return_inverse=True)
+        freqs = np.bincount(codes)
+        n, n_labels = len(codes), len(freqs)
+        if not 1 < n_labels < n:
+            raise ValueError(
+                f"Number of labels is {n_labels}. Valid values are 2 to n_samples - 1 (inclusive)"
+            )
+
+        # float32 against the cached matrix: ~5x faster, ~1e-7 relative error
+        onehot = np.zeros((n, n_labels), dtype=np.float32 if self.precompute else np.float64)
+        onehot[np.arange(n), codes] = 1.0
+        sums = np.empty((n, n_labels))
+        for start, block in self._distance_blocks():
+            sums[start:start + len(block)] = block @ onehot
+
+        rows = np.arange(n)
+        own = freqs[codes]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intra = sums[rows, codes] / (own - 1)
+            sums[rows, codes] = np.inf
+            inter = (sums / freqs).min(axis=1)
+            sil = np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+        sil[own == 1] = 0
+        return float(sil.mean())
+
+    def davies_bouldin(self, labels):
+        return davies_bouldin_score(self.X, self._labels(labels))
+
+    def calinski_harabasz(self, labels):
+        return calinski_harabasz_score(self.X, self._labels(labels))
+
+    def evaluate(self, labels, strict=True):
+        """
+        Same dict as evaluate_model. strict=False scores each metric
+        independently and returns None for the ones that fail.
+        """
+        if not strict:
+            out = {}
+            for name, fn in [("silhouette", self.silhouette),
+                             ("davies_bouldin", self.davies_bouldin),
+                             ("calinski_harabasz", self.calinski_harabasz)]:
+                try:
+                    out[name] = fn(labels)
+                except Exception:
+                    out[name] = None
+            return out
+
+        # ensure at least 2 clusters
+        if len(np.unique(labels)) < 2:
+            return {
+                "silhouette": None,
+                "davies_bouldin": None,
+                "calinski_harabasz": None,
+                "note": "Only one cluster found"
+            }
         return {
-            "silhouette": None,
-            "davies_bouldin": None,
-            "calinski_harabasz": None,
-            "note": "Only one cluster found"
+            "silhouette": self.silhouette(labels),
+            "davies_bouldin": self.davies_bouldin(labels),
+            "calinski_harabasz": self.calinski_harabasz(labels)
         }
 
-    # sample data if too large
-    if len(X) > sample_size:
-        rng = np.random.RandomState(random_state)
-        idx = rng.choice(len(X), size=sample_size, replace=False)
-        X_sample = X[idx]
-        labels_sample = labels[idx]
-    else:
-        X_sample, labels_sample = X, labels
-
-    return {
-        "silhouette": silhouette_score(X_sample, labels_sample),
-        "davies_bouldin": davies_bouldin_score(X_sample, labels_sample),
-        "calinski_harabasz": calinski_harabasz_score(X_sample, labels_sample)
-    }
+
+def evaluate_model(X, labels, sample_size=10000, random_state=42):
+    """One-off evaluation; use ClusterEvaluator to score many labelings of the same X."""
+    evaluator = ClusterEvaluator(X, sample_size=sample_size, random_state=random_state, max_memory_mb=0)
+    return evaluator.evaluate(labels)
+
+
+def evaluate_model_fast(X, labels, sample_size=2000, random_state=42):
+    """Sampled silhouette, Davies-Bouldin / Calinski-Harabasz on all of X; failures become None."""
+    evaluator = ClusterEvaluator(X, sample_size=None, silhouette_sample=sample_size,
+                                 random_state=random_state, max_memory_mb=0)
+    return evaluator.evaluate(labels, strict=False)
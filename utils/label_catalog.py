@@ -0,0 +1,115 @@
+# utils/label_catalog.py
+"""
+Full-catalog spectral labels.
+
+Spectral clustering only runs on the tuning sample; main.py also trains a
+RandomForestClassifier to imitate it. This step streams the whole catalog
+through scaler -> PCA -> classifier in fixed-size chunks on a joblib
+process pool (each worker loads the models once) and writes the labelled
+catalog to CLUSTERED_PATHS["spectral_full"], which the serving layer loads
+like any other clustered dataset. Rows with missing features are left out.
+
+Run on its own with:  python -m utils.label_catalog
+"""
+import os
+import json
+import time
+import logging
+from collections import deque
+import numpy as np
+import joblib
+from joblib import Parallel, delayed
+from tqdm import tqdm
+
+from utils.artifacts import (
+    FEATURES_PATH, CATALOG_PATH, CLUSTERED_PATHS,
+    SPECTRAL_CLASSIFIER_PATH, SPECTRAL_SCALER_PATH, SPECTRAL_PCA_PATH,
+)
+from utils.embeddings import fold_affine
+from utils.preprocessing import iter_data, CHUNK_SIZE
+from utils.storage import dataset_columns, write_dataset_chunks
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_COLUMN = "cluster_spectral"
+
+# Per-worker models, reloaded only when the files on disk change
+_WORKER_MODELS = {"key": None}
+
+
+def model_key(paths):
+    return tuple((path, os.path.getmtime(path)) for path in paths if os.path.exists(path))
+
+
+def load_label_models(classifier_path=SPECTRAL_CLASSIFIER_PATH, scaler_path=SPECTRAL_SCALER_PATH,
+                      pca_path=SPECTRAL_PCA_PATH):
+    """(classifier, W, b): the classifier and its scaler + PCA folded into one affine map."""
+    clf = joblib.load(classifier_path)
+    clf.n_jobs = 1  # parallelism comes from the chunk pool
+    scaler = joblib.load(scaler_path)
+    pca = joblib.load(pca_path) if os.path.exists(pca_path) else None
+    W, b = fold_affine(scaler, pca)
+    return clf, W, b
+
+
+def _label_chunk(X, model_paths, key):
+    """Worker entry point: cluster labels for one chunk of raw feature rows."""
+    if _WORKER_MODELS["key"] != key:
+        _WORKER_MODELS.clear()
+        _WORKER_MODELS["key"] = key
+        _WORKER_MODELS["models"] = load_label_models(*model_paths)
+    clf, W, b = _WORKER_MODELS["models"]
+    return clf.predict(X.astype(np.float64) @ W + b).astype(np.int32)
+
+
+def iter_labelled(data_path, features, model_paths, chunk_size=CHUNK_SIZE, n_jobs=-1):
+    """
+    Labelled catalog chunks, in file order. Chunks are read lazily: the pool
+    only holds a few in flight (pre_dispatch), so memory stays bounded by the
+    chunk size rather than the catalog size.
+    """
+    features = list(features)
+    columns = dataset_columns(data_path)
+    key = model_key(model_paths)
+    pending = deque()
+
+    def tasks():
+        for chunk in iter_data(data_path, features, columns=columns, chunk_size=chunk_size):
+            pending.append(chunk)
+            yield delayed(_label_chunk)(chunk[features].to_numpy(), model_paths, key)
+
+    for labels in Parallel(n_jobs=n_jobs, return_as="generator")(tasks()):
+        chunk = pending.popleft()
+        chunk[CLUSTER_COLUMN] = labels
+        yield chunk
+
+
+def label_catalog(data_path=CATALOG_PATH, out_path=None, features=None, chunk_size=CHUNK_SIZE, n_jobs=-1,
+                  model_paths=(SPECTRAL_CLASSIFIER_PATH, SPECTRAL_SCALER_PATH, SPECTRAL_PCA_PATH)):
+    """Label every catalog row with the spectral classifier and write the dataset. Returns out_path."""
+    if out_path is None:
+        out_path = CLUSTERED_PATHS["spectral_full"]
+    if features is None:
+        with open(FEATURES_PATH, "r") as f:
+            features = json.load(f)
+
+    start = time.perf_counter()
+    progress = tqdm(desc="Labelling catalog", unit="rows", unit_scale=True)
+
+    def tracked():
+        for chunk in iter_labelled(data_path, features, model_paths, chunk_size, n_jobs):
+            progress.update(len(chunk))
+            yield chunk
+
+    n_rows = write_dataset_chunks(tracked(), out_path)
+    progress.close()
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Labelled {n_rows} tracks in {seconds:.1f}s ({n_rows / max(seconds, 1e-9):,.0f} rows/s) -> {out_path}"
+    )
+    return out_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    label_catalog()
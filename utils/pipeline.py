@@ -0,0 +1,126 @@
+# utils/pipeline.py
+"""
+Content-hash cached pipeline stages for main.py.
+
+A stage is keyed by a hash of its parameters, the bytes of its input files,
+the source of the code it runs and the keys of the stages it depends on.
+When the key is unchanged (and the stage's declared output files still
+exist) its cached return value is loaded instead of rerunning it. Changing
+any input re-keys the stage and, through the chained keys, every stage
+downstream of it. Stages whose files are only known once they ran pass
+outputs as a function of their return value; the list it gives is stored
+next to the cache entry.
+
+Force reruns with PIPELINE_FORCE=all or PIPELINE_FORCE=stage_a,stage_b.
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+import inspect
+import logging
+import joblib
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "results/pipeline_cache"
+
+
+def file_digest(paths):
+    """sha1 over the contents of the given files."""
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(path.encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:12]
+
+
+def code_version(*objects):
+    """sha1 over the source of the given modules / functions / classes."""
+    h = hashlib.sha1()
+    for obj in objects:
+        h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+class Pipeline:
+    def __init__(self, cache_dir=CACHE_DIR, force=None):
+        self.cache_dir = cache_dir
+        if force is None:
+            force = os.environ.get("PIPELINE_FORCE", "")
+        self.force = {name.strip() for name in force.split(",") if name.strip()}
+        self.keys = {}
+        self.outputs = {}
+        self.history = []  # (stage, "ran" | "cached", seconds)
+
+    def key(self, name, params=None, files=(), code=(), deps=(), outputs=()):
+        """Register a stage and return its key."""
+        payload = {
+            "name": name,
+            "params": params,
+            "files": file_digest(files) if files else None,
+            "code": code_version(*code) if code else None,
+            "deps": [self.keys[dep] for dep in deps],
+        }
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        self.keys[name] = key
+        self.outputs[name] = outputs if callable(outputs) else list(outputs)
+        return key
+
+    def _cache_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}-{self.keys[name]}.joblib")
+
+    def _outputs_path(self, name):
+        return f"{self._cache_path(name)[:-len('.joblib')]}.outputs.json"
+
+    def _declared_outputs(self, name):
+        """Output files of the cached run, or None when they were never recorded."""
+        if not callable(self.outputs[name]):
+            return self.outputs[name]
+        if not os.path.exists(self._outputs_path(name)):
+            return None
+        with open(self._outputs_path(name), "r") as f:
+            return json.load(f)
+
+    def is_fresh(self, name):
+        if "all" in self.force or name in self.force:
+            return False
+        outputs = self._declared_outputs(name)
+        return os.path.exists(self._cache_path(name)) and outputs is not None and all(os.path.exists(p) for p in outputs)
+
+    def run(self, name, fn):
+        """fn() when the stage is stale, otherwise its cached result."""
+        start = time.perf_counter()
+        path = self._cache_path(name)
+        if self.is_fresh(name):
+            value = joblib.load(path)
+            status = "cached"
+        else:
+            value = fn()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if callable(self.outputs[name]):
+                with open(self._outputs_path(name), "w") as f:
+                    json.dump(list(self.outputs[name](value)), f)
+            tmp = f"{path}.tmp"
+            joblib.dump(value, tmp)
+            os.replace(tmp, path)
+            # Keep one entry per stage
+            for old in glob.glob(os.path.join(self.cache_dir, f"{name}-*")):
+                if old not in (path, self._outputs_path(name)):
+                    os.remove(old)
+            status = "ran"
+        self.record(name, status, time.perf_counter() - start)
+        return value
+
+    def record(self, name, status, seconds):
+        """Add work done outside run() (e.g. a pool shared by several stages) to the history."""
+        self.history.append((name, status, seconds))
+        logger.info(f"Stage {name}: {status} in {seconds:.1f}s")
+
+    def stage(self, name, fn, params=None, files=(), code=(), deps=(), outputs=()):
+        """key() + run() in one call."""
+        self.key(name, params=params, files=files, code=code, deps=deps, outputs=outputs)
+        return self.run(name, fn)
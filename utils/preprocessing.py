@@ -1,10 +1,120 @@
 from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
+from pandas.api.types import union_categoricals
+import numpy as np
 import pandas as pd
 
+from utils.storage import iter_dataset
+from utils.embeddings import fold_affine
+
+CHUNK_SIZE = 100_000
+
+
 def load_data(path):
     return pd.read_csv(path)
 
+
+# =============================
+# Chunked, dtype-compact loading for the full catalog
+# =============================
+def compact_dtypes(chunk, features, id_column="id"):
+    """
+    float32 features, int32 / float32 for the other numeric columns and
+    categoricals for text (the id column stays plain: it is unique per row).
+    """
+    for col in chunk.columns:
+        values = chunk[col]
+        if col in features:
+            chunk[col] = values.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(values):
+            chunk[col] = pd.to_numeric(values, downcast="integer")
+            if chunk[col].dtype.itemsize < 4:
+                chunk[col] = chunk[col].astype(np.int32)
+        elif pd.api.types.is_float_dtype(values):
+            chunk[col] = values.astype(np.float32)
+        elif col != id_column and not isinstance(values.dtype, pd.CategoricalDtype):
+            chunk[col] = values.astype("category")
+    return chunk
+
+
+def iter_data(path, features, columns=None, chunk_size=CHUNK_SIZE, id_column="id"):
+    """
+    Compact chunks of the dataset: only the features (plus columns) are read,
+    features are parsed straight to float32, and rows with a missing feature
+    are dropped.
+    """
+    features = list(features)
+    usecols = list(dict.fromkeys(list(columns or []) + features))
+    dtype = {f: np.float32 for f in features}
+    for chunk in iter_dataset(path, columns=usecols, chunk_size=chunk_size, dtype=dtype):
+        chunk = chunk.dropna(subset=features)
+        if len(chunk):
+            yield compact_dtypes(chunk, features, id_column)
+
+
+def load_data_chunked(path, features, columns=None, chunk_size=CHUNK_SIZE, id_column="id"):
+    """load_data for catalog-scale files: iter_data chunks joined into one compact frame."""
+    chunks = list(iter_data(path, features, columns, chunk_size, id_column))
+    if not chunks:
+        raise ValueError(f"No rows with complete features in {path}")
+    # Chunks carry their own categories; unify them so concat keeps the categoricals
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categories = union_categoricals([c[col] for c in chunks]).categories
+            for c in chunks:
+                c[col] = c[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def count_rows(path, features, chunk_size=CHUNK_SIZE):
+    """Rows iter_data yields (complete features), counted without keeping them."""
+    return sum(len(chunk) for chunk in iter_data(path, features, chunk_size=chunk_size))
+
+
+def stream_matrix(path, features, scaler=None, pca=None, out=None, out_path=None,
+                  id_column="id", chunk_size=CHUNK_SIZE, dtype=np.float32):
+    """
+    (X, ids): the feature matrix of the dataset, scaled / PCA-projected when
+    scaler (and pca) are given, written chunk by chunk so only one chunk of
+    raw rows is in memory at a time.
+        out      : preallocated array with one row per complete-feature row
+        out_path : .npy file to fill as a memory map (costs one counting pass)
+        neither  : an in-memory array (rows counted first as well)
+    ids holds the id_column values (None when id_column is None).
+    """
+    W = b = None
+    if scaler is not None:
+        W, b = fold_affine(scaler, pca)
+    width = W.shape[1] if W is not None else len(features)
+
+    if out is None:
+        n_rows = count_rows(path, features, chunk_size)
+        if out_path is not None:
+            out = np.lib.format.open_memmap(out_path, mode="w+", dtype=dtype, shape=(n_rows, width))
+        else:
+            out = np.empty((n_rows, width), dtype=dtype)
+
+    ids = []
+    columns = [id_column] if id_column is not None else None
+    start = 0
+    for chunk in iter_data(path, features, columns, chunk_size, id_column):
+        X = chunk[list(features)].to_numpy(dtype=np.float64 if W is not None else dtype)
+        if W is not None:
+            X = X @ W + b
+        if start + len(X) > len(out):
+            raise ValueError(f"out has {len(out)} rows, {path} has more complete-feature rows")
+        out[start:start + len(X)] = X
+        start += len(X)
+        if id_column is not None:
+            ids.append(chunk[id_column].to_numpy(dtype=str))
+    if start != len(out):
+        raise ValueError(f"out has {len(out)} rows, {path} has {start} complete-feature rows")
+    if isinstance(out, np.memmap):
+        out.flush()
+    if id_column is None:
+        return out, None
+    return out, np.concatenate(ids) if ids else np.empty(0, dtype=str)
+
 def preprocess_data(df, features, use_pca=True, variance_threshold=0.9):
     # Step 1: Scale features
     scaler = StandardScaler()
@@ -18,3 +128,87 @@ def preprocess_data(df, features, use_pca=True, variance_threshold=0.9):
         return X_transformed, scaler, pca
     else:
         return X_scaled, scaler, None
+
+
+# =============================
+# Out-of-core scaler + PCA fitting
+# =============================
+def preprocess_incremental(path, features, use_pca=True, variance_threshold=0.9, chunk_size=CHUNK_SIZE):
+    """
+    preprocess_data for catalogs that do not fit in memory: StandardScaler
+    and PCA are fitted with partial_fit over iter_data chunks (one pass
+    each) and returned as (scaler, pca), interchangeable with the in-memory
+    artifacts. Project the catalog afterwards with stream_matrix.
+    """
+    features = list(features)
+    scaler = StandardScaler()
+    for chunk in iter_data(path, features, chunk_size=chunk_size):
+        scaler.partial_fit(chunk[features].astype(np.float64))
+    if not hasattr(scaler, "mean_"):
+        raise ValueError(f"No rows with complete features in {path}")
+    if not use_pca:
+        return scaler, None
+
+    # IncrementalPCA needs at least n_features rows per batch: a short chunk
+    # is held back and fitted together with its neighbours
+    ipca = IncrementalPCA()
+    pending = []
+    for chunk in iter_data(path, features, chunk_size=chunk_size):
+        X = scaler.transform(chunk[features].astype(np.float64))
+        if len(X) >= len(features) and sum(len(P) for P in pending) >= len(features):
+            ipca.partial_fit(np.concatenate(pending))
+            pending = []
+        pending.append(X)
+    if sum(len(P) for P in pending) < len(features):
+        raise ValueError(f"{path} has fewer complete rows than features")
+    ipca.partial_fit(np.concatenate(pending))
+    return scaler, truncate_pca(ipca, variance_threshold)
+
+
+def truncate_pca(ipca, variance_threshold=0.9):
+    """
+    PCA keeping variance_threshold of the variance, built from a fitted
+    full-rank IncrementalPCA the same way PCA(n_components=float) truncates.
+    """
+    ratio = ipca.explained_variance_ratio_
+    k = min(int(np.searchsorted(np.cumsum(ratio), variance_threshold, side="right")) + 1, len(ratio))
+
+    pca = PCA(n_components=variance_threshold, svd_solver="full")
+    pca.mean_ = ipca.mean_
+    pca.components_ = ipca.components_[:k].copy()
+    pca.explained_variance_ = ipca.explained_variance_[:k].copy()
+    pca.explained_variance_ratio_ = ratio[:k].copy()
+    pca.singular_values_ = ipca.singular_values_[:k].copy()
+    pca.noise_variance_ = ipca.explained_variance_[k:].mean() if k < len(ratio) else 0.0
+    pca.n_components_ = k
+    pca.n_samples_ = int(ipca.n_samples_seen_)
+    pca.n_features_in_ = ipca.n_features_in_
+    return pca
+
+
+def slice_scaler(scaler, features, subset):
+    """StandardScaler for a column subset, taken from one fitted on all features (no refit)."""
+    cols = [list(features).index(f) for f in subset]
+    sub = StandardScaler()
+    sub.mean_ = scaler.mean_[cols]
+    sub.var_ = scaler.var_[cols]
+    sub.scale_ = scaler.scale_[cols]
+    sub.n_samples_seen_ = scaler.n_samples_seen_
+    sub.n_features_in_ = len(cols)
+    sub.feature_names_in_ = np.asarray(list(subset), dtype=object)
+    return sub
+
+
+def fit_pca(X, variance_threshold=0.9):
+    """
+    PCA keeping variance_threshold of the variance. Uses the covariance
+    eigensolver (cheap for tall, narrow audio-feature matrices) when this
+    scikit-learn has it, otherwise the full SVD.
+    """
+    try:
+        pca = PCA(n_components=variance_threshold, svd_solver="covariance_eigh")
+        X_transformed = pca.fit_transform(X)
+    except ValueError:
+        pca = PCA(n_components=variance_threshold, svd_solver="full")
+        X_transformed = pca.fit_transform(X)
+    return X_transformed, pca
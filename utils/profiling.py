@@ -0,0 +1,131 @@
+# utils/profiling.py
+"""
+Per-trial cost instrumentation for the tuners.
+
+A TrialProfile records, for one trial:
+    n_samples, n_features   input shape
+    fit_time, eval_time     wall seconds spent fitting / scoring
+    shared_fit_time         precompute the trial reuses (merge tree,
+                            spectral embedding, radius graph), repeated on
+                            every row that shares it
+    peak_mem_mb             memory high-water mark while the trial ran
+
+TRACK_TRIAL_MEMORY picks how peak_mem_mb is measured:
+    rss          (default) peak resident set size of the process, reset
+                 per trial through /proc/self/clear_refs (Linux; None
+                 elsewhere). Free, and sees native BLAS / libsvm buffers.
+    tracemalloc  peak Python + NumPy allocations above the trial's start.
+                 Portable, but roughly doubles tuning time.
+    0            no memory tracking.
+"""
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACK_MEMORY = os.environ.get("TRACK_TRIAL_MEMORY", "rss")
+
+COST_COLUMNS = ["n_samples", "n_features", "fit_time", "eval_time", "shared_fit_time", "peak_mem_mb"]
+
+
+def _reset_peak_rss():
+    """Reset the kernel's VmHWM counter; False where that is not supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss():
+    """VmHWM of this process in bytes."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+class TrialProfile:
+    def __init__(self, X, shared=None):
+        self.n_samples, self.n_features = (int(d) for d in X.shape[:2])
+        self.fit_time = 0.0
+        self.eval_time = 0.0
+        self.peak = None
+        self.shared = shared
+        self._rss = False
+        self._started = False
+        self._baseline = 0
+
+    def __enter__(self):
+        if TRACK_MEMORY == "rss":
+            self._rss = _reset_peak_rss()
+        elif TRACK_MEMORY == "tracemalloc":
+            self._started = not tracemalloc.is_tracing()
+            if self._started:
+                tracemalloc.start()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        peak = None
+        if self._rss:
+            peak = _peak_rss()
+        elif TRACK_MEMORY == "tracemalloc":
+            peak = tracemalloc.get_traced_memory()[1] - self._baseline
+            if self._started:
+                tracemalloc.stop()
+        if peak is not None:
+            self.peak = max(self.peak or 0, peak)
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        """Time a "fit" or "eval" block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if name == "fit":
+                self.fit_time += elapsed
+            else:
+                self.eval_time += elapsed
+
+    def stats(self):
+        peak = self.peak
+        if self.shared is not None and self.shared.peak is not None:
+            peak = max(peak or 0, self.shared.peak)
+        return {
+            "n_samples": self.n_samples,
+            "n_features": self.n_features,
+            "fit_time": self.fit_time,
+            "eval_time": self.eval_time,
+            "shared_fit_time": self.shared.fit_time if self.shared is not None else 0.0,
+            "peak_mem_mb": peak / 2**20 if peak is not None else None,
+        }
+
+    def add_to(self, metrics):
+        """Merge the stats into a tuner results row (returns it)."""
+        metrics.update(self.stats())
+        return metrics
+
+
+def cost_summary(results):
+    """
+    Totals over a tuner's results rows: trials, fit / eval seconds, shared
+    precompute seconds (each shared build counted once) and the largest peak.
+    """
+    rows = [r for r in results if r is not None and r.get("fit_time") is not None]
+    # Rows sharing a build carry the identical float, so distinct values = builds
+    shared = {r["shared_fit_time"] for r in rows if r.get("shared_fit_time")}
+    peaks = [r["peak_mem_mb"] for r in rows if r.get("peak_mem_mb") is not None]
+    return {
+        "trials": len(rows),
+        "fit_time": sum(r["fit_time"] for r in rows),
+        "eval_time": sum(r["eval_time"] for r in rows),
+        "shared_fit_time": sum(shared),
+        "peak_mem_mb": max(peaks) if peaks else None,
+    }
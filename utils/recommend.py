@@ -1,8 +1,22 @@
+import os
+import numpy as np
 import pandas as pd
 import joblib
 import json
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
+import threading
+from collections import ChainMap
+
+from utils.artifacts import (
+    FEATURES_PATH, SCALER_PATH, PCA_PATH, CLUSTERED_PATHS, embedding_paths, index_path, topk_paths,
+    ASSIGNER_PATH, SPECTRAL_CLASSIFIER_PATH, CLUSTER_MODEL_PATHS, ingested_path,
+)
+from utils.assign import CentroidAssigner
+from utils.embeddings import fold_affine, embed
+from utils.ann_index import load_index, ids_digest, top_k_rows
+from utils.topk_table import load_topk_table, seed_chunk_size, TOPK_MODES
+from utils.storage import read_dataset, append_dataset, dataset_exists, dataset_columns, parquet_path
+from utils.cache import artifact_version
 
 # =============================
 # Setup logging
@@ -11,123 +25,725 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # =============================
-# Load best features automatically
+# Feature projection (best features + scaler + PCA)
 # =============================
-try:
-    with open("saved_models/kmeans/best_features.json", "r") as f:
-        FEATURES = json.load(f)
-except Exception as e:
-    logger.error(f"Failed to load best_features.json: {str(e)}")
-    raise
+class Projection:
+    """
+    The saved feature list, scaler and PCA, plus the folded affine map
+    (W, b) used to project whole blocks of raw rows. Loaded by every
+    RecommenderEngine.reload() and kept on its Catalog, so a retrain is
+    picked up together with the catalog it produced.
+    """
 
-# =============================
-# Clustered datasets per algorithm
-# =============================
-CLUSTERED_PATHS = {
-    "kmeans": "clustered_datasets_old/spotify_kmeans_sample.csv",
-    "gmm": "clustered_datasets_old/spotify_gmm_sample.csv",
-    "agglomerative": "clustered_datasets_old/spotify_agglomerative_sample.csv",
-    "dbscan": "clustered_datasets_old/spotify_dbscan_sample.csv",
-    "spectral": "clustered_datasets_new/spotify_spectral_sample.csv"
-}
+    def __init__(self, features, scaler, pca=None):
+        self.features = features
+        self.scaler = scaler
+        self.pca = pca
+        self.W, self.b = fold_affine(scaler, pca)
 
-# =============================
-# Load scaler + PCA
-# =============================
-try:
-    scaler = joblib.load("saved_models/kmeans/scaler_sample_features.joblib")
-except Exception as e:
-    logger.error(f"Failed to load scaler: {str(e)}")
-    raise
+    @classmethod
+    def load(cls):
+        try:
+            with open(FEATURES_PATH, "r") as f:
+                features = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load best_features.json: {str(e)}")
+            raise
+        try:
+            scaler = joblib.load(SCALER_PATH)
+        except Exception as e:
+            logger.error(f"Failed to load scaler: {str(e)}")
+            raise
+        try:
+            pca = joblib.load(PCA_PATH)
+        except Exception:
+            pca = None
+            logger.warning("No PCA model found, proceeding without PCA")
+        return cls(features, scaler, pca)
+
+    def embed(self, frame):
+        """L2-normalised embeddings for the raw feature rows of frame (missing values as 0)."""
+        return embed(frame[self.features].fillna(0).to_numpy(), self.W, self.b)
 
-try:
-    pca = joblib.load("saved_models/kmeans/pca_sample_features.joblib")
-except:
-    pca = None
-    logger.warning("No PCA model found, proceeding without PCA")
 
 # =============================
 # Preprocess features
 # =============================
-def preprocess_features(row, features=FEATURES):
-    """Scale + reduce features for a single song row."""
+def preprocess_features(row, projection=None):
+    """
+    Scale + reduce features for a single song row.
+
+    Catalog songs use the precomputed embeddings instead; this is only
+    needed for songs that are not in the catalog.
+    """
+    projection = projection or Projection.load()
+    features = projection.features
     # Ensure row is a DataFrame with feature names
     x = pd.DataFrame([row[features]], columns=features)
     if x.isna().any().any():
         logger.warning(f"Missing features for song {row.get('id', 'unknown')}, filling with 0")
         x = x.fillna(0)
-    x_scaled = scaler.transform(x)
-    if pca:
-        x_scaled = pca.transform(x_scaled)
+    x_scaled = projection.scaler.transform(x)
+    if projection.pca:
+        x_scaled = projection.pca.transform(x_scaled)
     return x_scaled
 
+# =============================
+# Precomputed embeddings
+# =============================
+def load_embeddings(algo, ids, projection):
+    """
+    Load the offline embeddings for algo (see utils/embeddings.py).
+    Returns None when they are missing, older than the models or were
+    built for different ids.
+    """
+    emb_path, ids_path = embedding_paths(algo)
+    if not (os.path.exists(emb_path) and os.path.exists(ids_path)):
+        return None
+    model_mtime = max(os.path.getmtime(p) for p in (SCALER_PATH, PCA_PATH) if os.path.exists(p))
+    stored_ids = np.load(ids_path)
+    emb = np.load(emb_path)
+    if (os.path.getmtime(emb_path) < model_mtime
+            or emb.shape[1] != projection.W.shape[1]
+            or len(stored_ids) != len(ids)
+            or not np.array_equal(stored_ids, ids.astype(str))):
+        logger.warning(f"Embeddings for {algo} are stale, projecting on load instead")
+        return None
+    return emb
+
+
+def load_catalog_index(algo, ids):
+    """
+    Memory-map the nearest-neighbour index for algo (see utils/ann_index.py).
+    Returns None when there is none or it was built for a different catalog.
+    """
+    path = index_path(algo)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    index = load_index(path, mmap=True)
+    if index.meta.get("n") != len(ids) or index.meta.get("ids_sha1") != ids_digest(ids):
+        logger.warning(f"Index for {algo} does not match the catalog, using exact scan")
+        return None
+    logger.info(f"Using {index.kind} index for {algo} knn")
+    return index
+
+
+def load_topk_tables(algo, ids):
+    """Precomputed neighbour tables for algo (see utils/topk_table.py), keyed by mode."""
+    tables = {}
+    for mode in TOPK_MODES:
+        table = load_topk_table(algo, mode, ids)
+        if table is not None:
+            tables[mode] = table
+    return tables
+
+# =============================
+# In-memory recommendation engine
+# =============================
+def _with_room(arr, capacity):
+    """Copy of arr in a buffer of capacity rows (the rest left for appends)."""
+    out = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+
+class Catalog:
+    """
+    Immutable set of arrays for one clustered dataset.
+
+    features holds L2-normalised float32 embeddings, so cosine similarity
+    against a song is a single matrix-vector product; projection is the
+    Projection they were made with, so songs from outside the catalog are
+    embedded in the same space. index, when present,
+    answers full-catalog knn queries approximately; topk maps a mode to a
+    precomputed (indices, scores, K) neighbour table.
+    """
+
+    COLUMNS = ("ids", "names", "artists", "clusters", "features", "valid")
+
+    def __init__(self, ids, names, artists, clusters, features, valid, projection,
+                 index=None, topk=None, id_to_pos=None):
+        self.ids = ids
+        self.names = names
+        self.artists = artists
+        self.clusters = clusters
+        self.features = features
+        self.valid = valid
+        self.projection = projection
+        self.index = index
+        self.topk = topk or {}
+        self.version = None
+        self._store = None  # buffers the arrays are views of, with room to append (see extended)
+        if id_to_pos is None:
+            id_to_pos = {}
+            for pos, tid in enumerate(ids):
+                id_to_pos.setdefault(tid, pos)  # first occurrence wins, like .iloc[0]
+        self.id_to_pos = id_to_pos
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_frame(cls, df, projection, algo=None):
+        cluster_col = [c for c in df.columns if c.startswith("cluster_")][0]
+        raw = df[projection.features]
+        ids = df["id"].to_numpy(dtype=object)
+        features = load_embeddings(algo, ids, projection) if algo else None
+        if features is None:
+            features = projection.embed(df)
+        return cls(
+            ids=ids,
+            names=df["name"].to_numpy(dtype=object),
+            artists=df["artists"].to_numpy(dtype=object),
+            clusters=df[cluster_col].to_numpy(),
+            features=features,
+            valid=~raw.isna().any(axis=1).to_numpy(),
+            projection=projection,
+            index=load_catalog_index(algo, ids) if algo else None,
+            topk=load_topk_tables(algo, ids) if algo else None,
+        )
+
+    def extended(self, df):
+        """
+        New Catalog with df's rows (raw features + a cluster_ column)
+        appended; self is left untouched for the readers still using it.
+
+        Ingests are meant to be small and frequent, so this costs O(len(df))
+        rather than O(catalog): the arrays are views of buffers with spare
+        room that later rows are written past the end of (a full copy only
+        when the room runs out, growing by a quarter), new ids go in a small
+        map chained over the base lookup, and the ANN index keeps them in a
+        buffer next to the memory-mapped base (ann_index.BufferedIndex).
+        reload() starts again from the offline arrays with every ingested
+        song appended in one batch. Top-K tables are dropped because they
+        do not rank the new songs (they come back with the next offline
+        build).
+        """
+        cluster_col = [c for c in df.columns if c.startswith("cluster_")][0]
+        new_ids = df["id"].to_numpy(dtype=object)
+        new_features = self.projection.embed(df)
+        new = {
+            "ids": new_ids,
+            "names": df["name"].to_numpy(dtype=object),
+            "artists": df["artists"].to_numpy(dtype=object),
+            "clusters": df[cluster_col].to_numpy(),
+            "features": new_features,
+            "valid": ~df[self.projection.features].isna().any(axis=1).to_numpy(),
+        }
+        n_old, n_new = len(self), len(self) + len(df)
+
+        store = self._store
+        # Rows past n_old may only be written when no other Catalog sees them
+        if store is None or store["used"] != n_old or len(store["ids"]) < n_new:
+            capacity = n_new + max(len(df), n_old // 4)
+            store = {name: _with_room(getattr(self, name), capacity) for name in self.COLUMNS}
+        for name, values in new.items():
+            store[name][n_old:n_new] = values
+        store["used"] = n_new
+
+        if isinstance(self.id_to_pos, ChainMap):
+            added, base = dict(self.id_to_pos.maps[0]), self.id_to_pos.maps[1]
+        else:
+            added, base = {}, self.id_to_pos
+        for pos, tid in enumerate(new_ids, start=n_old):
+            if tid not in base:
+                added.setdefault(tid, pos)
+
+        if self.topk:
+            logger.info(f"Dropping top-K tables ({', '.join(self.topk)}) until the next offline build")
+        catalog = Catalog(
+            **{name: store[name][:n_new] for name in self.COLUMNS},
+            projection=self.projection,
+            index=self.index.extended(new_features) if self.index is not None else None,
+            id_to_pos=ChainMap(added, base),
+        )
+        catalog._store = store
+        return catalog
+
+    def from_topk(self, mode, pos, n):
+        """Top-n recommendations for pos from the precomputed table, or None if it can't answer."""
+        table = self.topk.get(mode)
+        if table is None or n > table[2]:
+            return None
+        indices, scores, _ = table
+        row = np.asarray(indices[pos, :n])
+        found = row >= 0
+        return self.frame(row[found], np.asarray(scores[pos, :n], dtype=np.float32)[found])
+
+    def frame(self, idx, similarity):
+        return pd.DataFrame({
+            "id": self.ids[idx],
+            "name": self.names[idx],
+            "artists": self.artists[idx],
+            "similarity": similarity,
+        })
+
+
+class RecommenderEngine:
+    """
+    Serves recommendations for one algorithm from memory.
+
+    The clustered dataset is read once into a Catalog; requests only do
+    math on its arrays. reload() and ingest() build a fresh Catalog and
+    swap it in with a single assignment, so in-flight requests keep a
+    consistent view and never wait for a rebuild.
+    """
+
+    def __init__(self, algo, path=None):
+        if path is None and algo not in CLUSTERED_PATHS:
+            raise ValueError(f"Unsupported algo: {algo}")
+        self.algo = algo
+        self.path = path or CLUSTERED_PATHS[algo]
+        self.cluster_col = None
+        self.catalog = None
+        self._write_lock = threading.Lock()  # serialises reload / ingest, never taken by readers
+        self.reload()
+
+    def reload(self):
+        """
+        Re-read the models and the dataset (plus songs ingested since it
+        was built) and swap in the new arrays.
+        """
+        with self._write_lock:
+            projection = Projection.load()
+            try:
+                cluster_col = [c for c in dataset_columns(self.path) if c.startswith("cluster_")][0]
+                columns = list(dict.fromkeys(["id", "name", "artists", cluster_col] + projection.features))
+                df = read_dataset(self.path, columns=columns)
+            except Exception as e:
+                logger.error(f"Failed to load dataset {self.path}: {str(e)}")
+                raise
+            self.cluster_col = cluster_col
+            catalog = Catalog.from_frame(df, projection, self.algo)
+            added = self.ingested(projection)
+            if added is not None:
+                # Offline artifacts match the dataset alone; ingested songs go on top
+                added = added[~added["id"].isin(df["id"])].drop_duplicates("id")
+                if len(added):
+                    catalog = catalog.extended(added[columns])
+            catalog.version = artifact_version(self.artifact_paths())
+            self.catalog = catalog
+            logger.info(f"Loaded {len(catalog)} songs for {self.algo} from {self.path} (version {catalog.version})")
+
+    def ingested(self, projection=None):
+        """
+        Songs ingested into this dataset so far, with clusters from the
+        current models and projection (the served one by default; None when
+        there are none). Every offline fit numbers
+        its clusters afresh, so the ids saved at ingest time go stale once
+        main.py reruns; songs no model can label are left out.
+        """
+        path = ingested_path(self.path)
+        if not dataset_exists(path):
+            return None
+        added = read_dataset(path)
+        if len(added) == 0:
+            return added
+        projection = projection or self.catalog.projection
+        try:
+            clusters, _ = predict_clusters(track_frame(added, projection.features), self.algo, projection)
+        except Exception as e:
+            logger.error(f"Cannot re-label {len(added)} ingested songs for {self.algo}, leaving them out: {str(e)}")
+            return None
+        added[self.cluster_col] = clusters
+        return added
+
+    def ingest(self, df):
+        """
+        Append new songs (id, name, artists, raw features and self.cluster_col)
+        without a restart: the extended Catalog is built off to the side and
+        swapped in, and the rows are appended to a file next to the dataset
+        so reload() and restarts keep them (re-labelled with the models of
+        the time). Ids already served are skipped. Returns the rows that
+        were added.
+        """
+        with self._write_lock:
+            cat = self.catalog
+            known = df["id"].map(lambda tid: tid in cat.id_to_pos).to_numpy(dtype=bool)
+            df = df[~known].drop_duplicates("id")
+            if len(df) == 0:
+                return df
+            catalog = cat.extended(df)
+
+            append_dataset(df, ingested_path(self.path))
+            catalog.version = artifact_version(self.artifact_paths())
+            self.catalog = catalog
+            logger.info(f"Ingested {len(df)} songs into {self.algo} ({len(catalog)} total, version {catalog.version})")
+            return df
+
+    def artifact_paths(self):
+        """Every file the served results depend on (used for cache invalidation)."""
+        paths = [FEATURES_PATH, SCALER_PATH, PCA_PATH, self.path, parquet_path(self.path)]
+        paths += [ingested_path(self.path), parquet_path(ingested_path(self.path))]
+        paths += list(embedding_paths(self.algo))
+        paths.append(os.path.join(index_path(self.algo), "meta.json"))
+        paths += [topk_paths(self.algo, mode)[2] for mode in TOPK_MODES]
+        return paths
+
+    @property
+    def version(self):
+        return self.catalog.version
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __contains__(self, song_id):
+        return song_id in self.catalog.id_to_pos
+
+    @staticmethod
+    def _rank(cat, song_id, song_features, candidates, n):
+        """Top-n candidates by cosine similarity (dot product), excluding song_id."""
+        sims = cat.features[candidates] @ song_features
+        keep = cat.ids[candidates] != song_id
+        candidates, sims = candidates[keep], sims[keep]
+        order = np.argsort(-sims, kind="stable")[:n]
+        return cat.frame(candidates[order], sims[order])
+
+    def _knn(self, cat, song_id, song_features, n, n_probe=None):
+        """Full-catalog knn, through the ANN index when one is loaded."""
+        if cat.index is not None:
+            found, sims = cat.index.query(song_features, n + 1, n_probe=n_probe)
+            keep = cat.ids[found] != song_id
+            if keep.sum() >= min(n, len(cat) - 1):
+                return cat.frame(found[keep][:n], sims[keep][:n])
+            # Probed lists were too small (or held duplicates of song_id)
+        return self._rank(cat, song_id, song_features, np.arange(len(cat)), n)
+
+    def recommend(self, song_id, n=5, mode="cluster_knn", n_probe=None):
+        cat = self.catalog
+        if song_id not in cat.id_to_pos:
+            logger.error(f"Song ID {song_id} not found")
+            raise ValueError(f"Song ID {song_id} not found")
+
+        pos = cat.id_to_pos[song_id]
+        if not cat.valid[pos]:
+            logger.warning(f"Song ID {song_id} has missing features")
+            return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
+
+        song_features = cat.features[pos]
+
+        # O(1) path: slice the offline top-K table when it covers n
+        if mode in cat.topk:
+            recs = cat.from_topk(mode, pos, n)
+            if recs is not None:
+                if len(recs) == 0:
+                    return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
+                return recs
+
+        if mode == "knn":
+            return self._knn(cat, song_id, song_features, n, n_probe)
+
+        elif mode == "cluster":
+            cluster_id = cat.clusters[pos]
+            candidates = np.flatnonzero((cat.clusters == cluster_id) & (cat.ids != song_id))
+            if len(candidates) == 0:
+                logger.warning(f"No candidates in cluster {cluster_id} for song {song_id}")
+                return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
+            # Same draw as DataFrame.sample(random_state=42)
+            rng = np.random.RandomState(42)
+            picked = candidates[rng.choice(len(candidates), size=min(n, len(candidates)), replace=False)]
+            return cat.frame(picked, 1.0)  # Default for cluster mode
+
+        elif mode == "cluster_knn":
+            cluster_id = cat.clusters[pos]
+            candidates = np.flatnonzero(cat.clusters == cluster_id)
+            if len(candidates) <= 1:
+                logger.warning(f"Cluster {cluster_id} has too few songs, falling back to KNN")
+                return self._knn(cat, song_id, song_features, n, n_probe)
+            recs = self._rank(cat, song_id, song_features, candidates, n)
+            if len(recs) == 0:
+                logger.warning(f"No valid candidates in cluster {cluster_id} for song {song_id}")
+                return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
+            return recs
+
+        else:
+            raise ValueError(f"Unsupported mode: {mode}")
+
+    def _rank_block(self, cat, seeds, candidates, n, block_size=None):
+        """
+        Score seed positions against candidate positions with blocked
+        matrix-matrix products and keep the top n per seed (excluding the
+        seed's own id). block_size=None sizes the blocks from sklearn's
+        working_memory, as the offline top-K sweep does. Returns
+        {seed position: DataFrame}.
+        """
+        out = {}
+        cand_features = cat.features[candidates]
+        block_size = block_size or seed_chunk_size(len(candidates), n_jobs=1)
+        for start in range(0, len(seeds), block_size):
+            block = seeds[start:start + block_size]
+            scores = cat.features[block] @ cand_features.T
+            # One extra slot covers the seed itself when it is a candidate
+            top, top_scores = top_k_rows(scores, n + 1)
+            for row, pos in enumerate(block):
+                found = candidates[top[row]]
+                keep = cat.ids[found] != cat.ids[pos]
+                if keep.sum() < min(n, len(candidates) - 1):
+                    # Seed id is duplicated in the catalog, redo this one exactly
+                    out[pos] = self._rank(cat, cat.ids[pos], cat.features[pos], candidates, n)
+                else:
+                    out[pos] = cat.frame(found[keep][:n], top_scores[row][keep][:n])
+        return out
+
+    def recommend_batch(self, song_ids, n=5, mode="cluster_knn", block_size=None, n_probe=None):
+        """
+        Recommendations for many seed songs at once.
+
+        knn and cluster_knn score all seeds with blocked matrix-matrix
+        products (cluster_knn one cluster at a time) and select the top n
+        per row with a partial sort. knn goes through the ANN index instead
+        when one is loaded (catalogs too large for an exact pass), like
+        recommend(). Returns {song_id: DataFrame}; unknown ids are left out.
+        """
+        if mode not in ("knn", "cluster", "cluster_knn"):
+            raise ValueError(f"Unsupported mode: {mode}")
+        cat = self.catalog
+        empty = pd.DataFrame(columns=["id", "name", "artists", "similarity"])
+
+        results, seeds = {}, []
+        for song_id in dict.fromkeys(song_ids):
+            pos = cat.id_to_pos.get(song_id)
+            if pos is None:
+                logger.warning(f"Song ID {song_id} not found")
+            elif not cat.valid[pos]:
+                logger.warning(f"Song ID {song_id} has missing features")
+                results[song_id] = empty
+            elif mode == "cluster":
+                results[song_id] = self.recommend(song_id, n=n, mode="cluster")
+            elif mode in cat.topk and n <= cat.topk[mode][2]:
+                results[song_id] = cat.from_topk(mode, pos, n)
+                if len(results[song_id]) == 0:
+                    results[song_id] = empty
+            else:
+                seeds.append(pos)
+        if not seeds:
+            return results
+        seeds = np.asarray(seeds)
+
+        if mode == "knn" and cat.index is not None:
+            ranked = {pos: self._knn(cat, cat.ids[pos], cat.features[pos], n, n_probe) for pos in seeds}
+        elif mode == "knn":
+            ranked = self._rank_block(cat, seeds, np.arange(len(cat)), n, block_size)
+        else:
+            ranked = {}
+            for cluster_id in np.unique(cat.clusters[seeds]):
+                group = seeds[cat.clusters[seeds] == cluster_id]
+                candidates = np.flatnonzero(cat.clusters == cluster_id)
+                if len(candidates) <= 1:
+                    logger.warning(f"Cluster {cluster_id} has too few songs, falling back to KNN")
+                    candidates = np.arange(len(cat))
+                ranked.update(self._rank_block(cat, group, candidates, n, block_size))
+
+        for pos in seeds:
+            results[cat.ids[pos]] = ranked[pos] if len(ranked[pos]) else empty
+        return results
+
+    def recommend_vectors(self, vectors, clusters, n=5, mode="cluster_knn", n_probe=None, block_size=None, cat=None):
+        """
+        Recommendations for songs that are not in the catalog, given their
+        embeddings (rows like Catalog.features) and cluster ids. Returns one
+        DataFrame per row. knn goes through the ANN index when one is loaded.
+        cat pins the Catalog the vectors were embedded for (the current one
+        by default).
+        """
+        if mode not in ("knn", "cluster_knn"):
+            raise ValueError(f"Unsupported mode: {mode}")
+        cat = cat or self.catalog
+        vectors = np.atleast_2d(vectors)
+        clusters = np.asarray(clusters)
+        everyone = np.arange(len(cat))
+        results = [None] * len(vectors)
+
+        def rank(rows, candidates):
+            cand_features = cat.features[candidates]
+            step = block_size or seed_chunk_size(len(candidates), n_jobs=1)
+            for start in range(0, len(rows), step):
+                block = rows[start:start + step]
+                top, top_scores = top_k_rows(vectors[block] @ cand_features.T, n)
+                for row, i in enumerate(block):
+                    results[i] = cat.frame(candidates[top[row]], top_scores[row])
+
+        if mode == "knn":
+            if cat.index is not None:
+                for i, q in enumerate(vectors):
+                    found, sims = cat.index.query(q, n, n_probe=n_probe)
+                    results[i] = cat.frame(found, sims)
+            else:
+                rank(np.arange(len(vectors)), everyone)
+            return results
+
+        for cluster_id in np.unique(clusters):
+            rows = np.flatnonzero(clusters == cluster_id)
+            candidates = np.flatnonzero(cat.clusters == cluster_id)
+            if len(candidates) == 0:
+                logger.warning(f"Cluster {cluster_id} has no songs, falling back to KNN")
+                candidates = everyone
+            rank(rows, candidates)
+        return results
+
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(algo="kmeans"):
+    """Return the shared engine for algo, loading it on first use."""
+    with _ENGINES_LOCK:
+        if algo not in _ENGINES:
+            _ENGINES[algo] = RecommenderEngine(algo)
+        return _ENGINES[algo]
+
+
+def reload_engines():
+    """Reload every engine that has been loaded so far."""
+    with _ENGINES_LOCK:
+        engines = list(_ENGINES.values())
+    for engine in engines:
+        engine.reload()
+
+
 # =============================
 # Recommendation function
 # =============================
-def get_recommendations(song_id, algo="kmeans", n=5, mode="cluster_knn"):
+def get_recommendations(song_id, algo="kmeans", n=5, mode="cluster_knn", n_probe=None):
     """
     mode options:
-        - "knn": full dataset KNN
+        - "knn": full dataset KNN (approximate if an ANN index is built)
         - "cluster": cluster-only
         - "cluster_knn": cluster + similarity
+
+    knn and cluster_knn are served from the precomputed top-K table when
+    n <= K. n_probe overrides the index's recall/latency setting for knn.
     """
-    try:
-        df = pd.read_csv(CLUSTERED_PATHS[algo])
-    except Exception as e:
-        logger.error(f"Failed to load dataset {CLUSTERED_PATHS[algo]}: {str(e)}")
-        raise
-
-    if song_id not in df["id"].values:
-        logger.error(f"Song ID {song_id} not found")
-        raise ValueError(f"Song ID {song_id} not found")
-
-    song_row = df.loc[df["id"] == song_id].iloc[0]
-    if song_row[FEATURES].isna().any():
-        logger.warning(f"Song ID {song_id} has missing features")
-        return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
-
-    song_features = preprocess_features(song_row)
-
-    if mode == "knn":
-        cand_features = pd.DataFrame(df[FEATURES], columns=FEATURES).fillna(0)
-        cand_features_scaled = scaler.transform(cand_features)
-        if pca:
-            cand_features_scaled = pca.transform(cand_features_scaled)
-        sim_scores = cosine_similarity(song_features, cand_features_scaled).flatten()
-        df["similarity"] = sim_scores
-        recs = df[df["id"] != song_id].sort_values("similarity", ascending=False)
-        return recs.head(n)[["id", "name", "artists", "similarity"]]
-
-    elif mode == "cluster":
-        cluster_col = [c for c in df.columns if c.startswith("cluster_")][0]
-        cluster_id = song_row[cluster_col]
-        candidates = df[df[cluster_col] == cluster_id].copy()
-        candidates = candidates[candidates["id"] != song_id]
-        if len(candidates) == 0:
-            logger.warning(f"No candidates in cluster {cluster_id} for song {song_id}")
-            return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
-        recs = candidates.sample(n=min(n, len(candidates)), random_state=42)
-        recs["similarity"] = 1.0  # Default for cluster mode
-        return recs[["id", "name", "artists", "similarity"]]
+    return get_engine(algo).recommend(song_id, n=n, mode=mode, n_probe=n_probe)
 
-    elif mode == "cluster_knn":
-        cluster_col = [c for c in df.columns if c.startswith("cluster_")][0]
-        cluster_id = song_row[cluster_col]
-        candidates = df[df[cluster_col] == cluster_id].copy()
-        if len(candidates) <= 1:
-            logger.warning(f"Cluster {cluster_id} has too few songs, falling back to KNN")
-            return get_recommendations(song_id, algo, n, "knn")
-        cand_features = pd.DataFrame(candidates[FEATURES], columns=FEATURES).fillna(0)
-        cand_features_scaled = scaler.transform(cand_features)
-        if pca:
-            cand_features_scaled = pca.transform(cand_features_scaled)
-        sim_scores = cosine_similarity(song_features, cand_features_scaled).flatten()
-        candidates["similarity"] = sim_scores
-        recs = candidates[candidates["id"] != song_id].sort_values("similarity", ascending=False)
-        if len(recs) == 0:
-            logger.warning(f"No valid candidates in cluster {cluster_id} for song {song_id}")
-            return pd.DataFrame(columns=["id", "name", "artists", "similarity"])
-        return recs.head(n)[["id", "name", "artists", "similarity"]]
 
+def get_recommendations_batch(song_ids, algo="kmeans", n=5, mode="cluster_knn", n_probe=None):
+    """
+    Batched get_recommendations: {song_id: DataFrame} for every known id.
+    Same modes and, for knn, the same ANN index when one is built.
+    """
+    return get_engine(algo).recommend_batch(song_ids, n=n, mode=mode, n_probe=n_probe)
+
+
+# =============================
+# Cluster assignment for unseen tracks
+# =============================
+MIN_ASSIGNER_AGREEMENT = float(os.environ.get("MIN_ASSIGNER_AGREEMENT", "0.95"))
+ASSIGNABLE_ALGOS = ["spectral", "spectral_full"]  # share the classifier's label space
+
+_ASSIGNER = {"key": None}
+_ASSIGNER_LOCK = threading.Lock()
+
+
+def get_assigner():
+    """
+    (predict, method, agreement): the distilled nearest-centroid model when
+    it agrees with the forest at least MIN_ASSIGNER_AGREEMENT of the time,
+    otherwise the forest itself (one vectorised predict per call). Reloaded
+    when the files on disk change.
+    """
+    paths = [p for p in (ASSIGNER_PATH, SPECTRAL_CLASSIFIER_PATH) if os.path.exists(p)]
+    key = tuple((p, os.path.getmtime(p)) for p in paths)
+    with _ASSIGNER_LOCK:
+        if _ASSIGNER["key"] != key:
+            if not os.path.exists(ASSIGNER_PATH):
+                raise FileNotFoundError(f"No cluster assigner at {ASSIGNER_PATH}, run main.py first")
+            assigner = CentroidAssigner.load(ASSIGNER_PATH)
+            predict, method = assigner.predict, "nearest_centroid"
+            if assigner.agreement is None or assigner.agreement < MIN_ASSIGNER_AGREEMENT:
+                clf = joblib.load(SPECTRAL_CLASSIFIER_PATH)
+                predict, method = (lambda raw: clf.predict(assigner.project(raw))), "random_forest"
+                logger.warning(
+                    f"Nearest-centroid agreement {assigner.agreement} below {MIN_ASSIGNER_AGREEMENT}, "
+                    "assigning with the random forest"
+                )
+            _ASSIGNER.update(key=key, value=(predict, method, assigner.agreement, assigner.features))
+        return _ASSIGNER["value"]
+
+
+_CLUSTER_MODELS = {}
+
+
+def track_frame(tracks, features):
+    """Tracks given as a dict, a list of dicts or a DataFrame, with numeric features columns."""
+    frame = pd.DataFrame([tracks] if isinstance(tracks, dict) else tracks).reset_index(drop=True)
+    for col in features:
+        frame[col] = pd.to_numeric(frame[col], errors="coerce") if col in frame.columns else np.nan
+    return frame
+
+
+def predict_clusters(frame, algo="spectral", projection=None):
+    """
+    (cluster ids, info) for raw feature rows. The spectral catalogs use
+    get_assigner(); kmeans and gmm use their final models on the rows
+    projected with projection (the served catalog's by default). Missing
+    features are filled with 0, as in preprocess_features.
+    """
+    if algo in ASSIGNABLE_ALGOS:
+        predict, method, agreement, features = get_assigner()
+    elif algo in CLUSTER_MODEL_PATHS:
+        path = CLUSTER_MODEL_PATHS[algo]
+        with _ASSIGNER_LOCK:
+            key = os.path.getmtime(path)
+            if _CLUSTER_MODELS.get(algo, (None,))[0] != key:
+                _CLUSTER_MODELS[algo] = (key, joblib.load(path))
+            model = _CLUSTER_MODELS[algo][1]
+        projection = projection or get_engine(algo).catalog.projection
+        method, agreement, features = algo, None, projection.features
+
+        def predict(raw):
+            return model.predict(raw @ projection.W + projection.b)  # the space the final models were fitted in
     else:
-        raise ValueError(f"Unsupported mode: {mode}")
\ No newline at end of file
+        raise ValueError(f"No model to assign {algo} clusters to new tracks")
+
+    raw = frame.reindex(columns=features)
+    if raw.isna().any().any():
+        logger.warning("Missing features for some tracks, filling with 0")
+        raw = raw.fillna(0)
+    return predict(raw.to_numpy(dtype=np.float64)), {"method": method, "agreement": agreement}
+
+
+def assign_tracks(tracks, algo="spectral", n=5, mode="cluster_knn", n_probe=None):
+    """
+    Cluster ids and nearest catalog neighbours for tracks given by their raw
+    audio features (a dict, a list of dicts or a DataFrame). Missing
+    features are filled with 0, as in preprocess_features.
+
+    Returns (clusters, [DataFrame of neighbours per track], info) where info
+    holds the assignment method and, for spectral, its agreement rate with
+    the forest.
+    """
+    engine = get_engine(algo)
+    cat = engine.catalog  # one snapshot: models and arrays from the same reload
+    frame = track_frame(tracks, cat.projection.features)
+    clusters, info = predict_clusters(frame, algo, cat.projection)
+    vectors = cat.projection.embed(frame)
+    neighbours = engine.recommend_vectors(vectors, clusters, n=n, mode=mode, n_probe=n_probe, cat=cat)
+    return clusters, neighbours, info
+
+
+# =============================
+# Incremental catalog updates
+# =============================
+def ingest_tracks(tracks, algo="spectral"):
+    """
+    Add new tracks (id, name, artists + raw audio features) to the served
+    catalog of algo without retraining or a restart: they are projected
+    with the saved scaler / PCA, assigned a cluster (predict_clusters) and
+    swapped into the engine (RecommenderEngine.ingest). Returns (the rows
+    added, with their cluster column, info); ids already in the catalog are
+    skipped.
+    """
+    engine = get_engine(algo)
+    projection = engine.catalog.projection
+    frame = track_frame(tracks, projection.features)
+    if "id" not in frame.columns or frame["id"].isna().any():
+        raise ValueError("Every track needs an id")
+    frame["id"] = frame["id"].astype(str)
+    for col in ["name", "artists"]:
+        if col not in frame.columns:
+            frame[col] = None
+    clusters, info = predict_clusters(frame, algo, projection)
+    frame[engine.cluster_col] = clusters
+    return engine.ingest(frame), info
@@ -0,0 +1,151 @@
+# utils/storage.py
+"""
+Dataset storage: Parquet next to the CSV.
+
+Paths throughout the repo stay the familiar .csv names; the columnar copy
+lives beside it as <name>.parquet. Readers prefer the Parquet file (column
+projection, memory-mapped reads) whenever it is at least as new as the CSV,
+and fall back to CSV when it is missing or pyarrow is not installed.
+
+Convert existing CSVs with:  python -m utils.storage
+"""
+import os
+import logging
+import pandas as pd
+
+from utils.artifacts import CLUSTERED_PATHS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+SERVING_DATASETS = list(CLUSTERED_PATHS.values()) + [
+    "clustered_datasets_new/spotify_spectral_with_preview.csv",
+]
+
+
+def parquet_path(path):
+    return os.path.splitext(path)[0] + ".parquet"
+
+
+def _use_parquet(path):
+    pq_path = parquet_path(path)
+    if pq is None or not os.path.exists(pq_path):
+        return False
+    return not os.path.exists(path) or os.path.getmtime(pq_path) >= os.path.getmtime(path)
+
+
+def dataset_exists(path):
+    return os.path.exists(path) or (pq is not None and os.path.exists(parquet_path(path)))
+
+
+def dataset_columns(path):
+    """Column names without reading any rows."""
+    if _use_parquet(path):
+        return list(pq.read_schema(parquet_path(path)).names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_dataset(path, columns=None):
+    """Read a dataset, preferring its Parquet copy; columns projects at read time."""
+    if _use_parquet(path):
+        return pd.read_parquet(parquet_path(path), columns=columns, memory_map=True)
+    return pd.read_csv(path, usecols=columns)
+
+
+def iter_dataset(path, columns=None, chunk_size=100_000, dtype=None):
+    """Read a dataset in chunks of up to chunk_size rows (Parquet row batches or CSV chunks)."""
+    if _use_parquet(path):
+        for batch in pq.ParquetFile(parquet_path(path)).iter_batches(batch_size=chunk_size, columns=columns):
+            chunk = batch.to_pandas()
+            yield chunk.astype(dtype) if dtype else chunk
+        return
+    yield from pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunk_size)
+
+
+def write_dataset(df, path, keep_csv=True):
+    """Write df as Parquet (when pyarrow is available) and, by default, as CSV too."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if keep_csv or pq is None:
+        df.to_csv(path, index=False)
+    if pq is not None:
+        df.to_parquet(parquet_path(path), index=False)
+    else:
+        logger.warning(f"pyarrow not installed, wrote {path} as CSV only")
+
+
+def append_dataset(df, path):
+    """
+    Append rows to a CSV dataset without rewriting it (O(len(df)) per call).
+    Columns follow the existing header. A Parquet copy cannot be appended
+    to, so it is folded into the CSV when it is the only copy and removed
+    otherwise; readers then use the CSV.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    pq_path = parquet_path(path)
+    if not os.path.exists(path) and pq is not None and os.path.exists(pq_path):
+        pd.read_parquet(pq_path).to_csv(path, index=False)
+    if os.path.exists(pq_path):
+        os.remove(pq_path)
+    if os.path.exists(path):
+        df.reindex(columns=dataset_columns(path)).to_csv(path, mode="a", header=False, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def write_dataset_chunks(chunks, path, keep_csv=True):
+    """
+    write_dataset for a stream of DataFrame chunks (same columns), so the
+    whole dataset never sits in memory. Files are written under a temporary
+    name and swapped in at the end. Returns the number of rows written.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_csv = keep_csv or pq is None
+    csv_tmp, pq_tmp = f"{path}.tmp", f"{parquet_path(path)}.tmp"
+    writer, schema, n_rows = None, None, 0
+    try:
+        for chunk in chunks:
+            if write_csv:
+                chunk.to_csv(csv_tmp, mode="a" if n_rows else "w", header=not n_rows, index=False)
+            if pq is not None:
+                # Per-chunk categoricals do not share a dictionary; store their values
+                chunk = chunk.astype({c: str for c in chunk.columns if isinstance(chunk[c].dtype, pd.CategoricalDtype)})
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pq.ParquetWriter(pq_tmp, schema)
+                writer.write_table(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if write_csv:
+        os.replace(csv_tmp, path)
+    if pq is not None and schema is not None:
+        os.replace(pq_tmp, parquet_path(path))
+    elif pq is None:
+        logger.warning(f"pyarrow not installed, wrote {path} as CSV only")
+    return n_rows
+
+
+def convert_csv(path):
+    """Write the Parquet copy of an existing CSV."""
+    if pq is None:
+        raise ImportError("pyarrow is required to write Parquet files")
+    df = pd.read_csv(path)
+    df.to_parquet(parquet_path(path), index=False)
+    logger.info(f"Converted {path} -> {parquet_path(path)} ({len(df)} rows)")
+    return parquet_path(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for path in SERVING_DATASETS:
+        if os.path.exists(path):
+            convert_csv(path)
+        else:
+            logger.warning(f"Skipping {path}: not found")
@@ -0,0 +1,188 @@
+# utils/topk_table.py
+"""
+Offline top-K neighbour tables.
+
+For a fixed catalog the knn and cluster_knn results are deterministic, so
+each song's K best neighbours are computed once with a chunked sweep over
+worker processes and stored as int32 positions + float16 scores (.npy,
+memory-mapped at serving time). Rows with fewer than K candidates are
+padded with -1.
+
+Each job scores a block of seeds against all of its candidates, so the
+block height is picked from sklearn's working_memory budget (split across
+the workers) divided by the candidate count, as pairwise_distances_chunked
+does. Full-catalog knn is O(N^2) to precompute; above max_exact_rows it is
+left to the ANN index (utils/ann_index.py) and only cluster_knn is built.
+
+Run on its own with:  python -m utils.topk_table
+"""
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn import get_config
+
+from utils.artifacts import CLUSTERED_PATHS, embedding_paths, topk_paths
+from utils.ann_index import ids_digest, top_k_rows
+from utils.storage import read_dataset, dataset_exists, dataset_columns
+
+logger = logging.getLogger(__name__)
+
+TOPK_MODES = ["knn", "cluster_knn"]
+
+# Per candidate, one seed row holds a float32 score, its negated copy
+# (argpartition) and an int64 partition index
+_BYTES_PER_SCORE = 4 + 4 + 8
+
+
+def seed_chunk_size(n_candidates, n_jobs=-1, working_memory=None):
+    """
+    Seeds per job so every worker's score block fits its share of
+    working_memory (MiB; sklearn's global setting by default).
+    """
+    if working_memory is None:
+        working_memory = get_config()["working_memory"]
+    budget = working_memory * 2**20 / effective_n_jobs(n_jobs)
+    return max(1, int(budget // (max(n_candidates, 1) * _BYTES_PER_SCORE)))
+
+
+def _topk_chunk(seed_X, cand_X, excluded, k):
+    """Top-k candidate slots for one chunk of seeds; excluded is (row, slot) pairs to skip."""
+    scores = seed_X @ cand_X.T
+    if len(excluded):
+        scores[excluded[:, 0], excluded[:, 1]] = -np.inf
+    top, top_scores = top_k_rows(scores, k)
+    top = top.astype(np.int32)
+    top[~np.isfinite(top_scores)] = -1
+    return top, top_scores
+
+
+def _same_id_positions(ids):
+    """position -> every position sharing its id (only for duplicated ids)."""
+    codes, uniques = pd.factorize(pd.Series(ids))
+    dup = {}
+    for code in np.flatnonzero(np.bincount(codes) > 1):
+        group = np.flatnonzero(codes == code)
+        for pos in group:
+            dup[pos] = group
+    return dup
+
+
+def _sweep(X, seeds, candidates, same_id, k, chunk_size, n_jobs):
+    """Top-k over candidates for every seed position, in parallel chunks (chunk_size=None: from the budget)."""
+    if chunk_size is None:
+        chunk_size = seed_chunk_size(len(candidates), n_jobs)
+    chunks = [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+    slot_of = {pos: slot for slot, pos in enumerate(candidates)}
+    cand_X = X[candidates]  # one array, shared (memory-mapped) across workers
+    jobs = []
+    for chunk in chunks:
+        excluded = []
+        for row, pos in enumerate(chunk):
+            for other in same_id.get(pos, [pos]):
+                if other in slot_of:
+                    excluded.append((row, slot_of[other]))
+        jobs.append(delayed(_topk_chunk)(
+            X[chunk], cand_X, np.asarray(excluded, dtype=np.intp).reshape(-1, 2), k
+        ))
+    out = Parallel(n_jobs=n_jobs)(jobs)
+
+    indices = np.full((len(seeds), k), -1, dtype=np.int32)
+    scores = np.zeros((len(seeds), k), dtype=np.float16)
+    row = 0
+    for top, top_scores in out:
+        width = top.shape[1]
+        found = top >= 0
+        indices[row:row + len(top), :width] = np.where(found, candidates[np.maximum(top, 0)], -1)
+        scores[row:row + len(top), :width] = np.where(found, top_scores, 0)
+        row += len(top)
+    return indices, scores
+
+
+def build_topk_table(X, ids, clusters=None, k=50, mode="knn", chunk_size=None, n_jobs=-1):
+    """
+    (indices int32 [N, k], scores float16 [N, k]) for every catalog row.
+    cluster_knn ranks within the song's cluster and, like the live path,
+    falls back to the whole catalog for clusters of one song.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    same_id = _same_id_positions(ids)
+    everyone = np.arange(len(X))
+
+    if mode == "knn":
+        return _sweep(X, everyone, everyone, same_id, k, chunk_size, n_jobs)
+    if mode != "cluster_knn":
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    indices = np.full((len(X), k), -1, dtype=np.int32)
+    scores = np.zeros((len(X), k), dtype=np.float16)
+    for cluster_id in np.unique(clusters):
+        members = np.flatnonzero(clusters == cluster_id)
+        candidates = members if len(members) > 1 else everyone
+        indices[members], scores[members] = _sweep(X, members, candidates, same_id, k, chunk_size, n_jobs)
+    return indices, scores
+
+
+def save_topk_table(algo, mode, indices, scores, ids):
+    idx_path, score_path, meta_path = topk_paths(algo, mode)
+    os.makedirs(os.path.dirname(idx_path), exist_ok=True)
+    np.save(idx_path, indices)
+    np.save(score_path, scores)
+    with open(meta_path, "w") as f:
+        json.dump({"algo": algo, "mode": mode, "k": indices.shape[1], "n": len(ids), "ids_sha1": ids_digest(ids)}, f)
+
+
+def load_topk_table(algo, mode, ids):
+    """
+    Memory-mapped (indices, scores, k) for algo/mode, or None when the table
+    is missing or was built for a different catalog.
+    """
+    idx_path, score_path, meta_path = topk_paths(algo, mode)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("n") != len(ids) or meta.get("ids_sha1") != ids_digest(ids):
+        logger.warning(f"Top-K table for {algo}/{mode} does not match the catalog, scoring live")
+        return None
+    return np.load(idx_path, mmap_mode="r"), np.load(score_path, mmap_mode="r"), meta["k"]
+
+
+def build_all_topk_tables(k=50, algos=None, modes=None, chunk_size=None, n_jobs=-1, max_exact_rows=50000):
+    """
+    Build knn and cluster_knn tables for every catalog whose embeddings
+    exist. knn is skipped for catalogs above max_exact_rows (the same size
+    build_all_indexes starts building an ANN index at).
+    """
+    built = {}
+    for algo in (algos or CLUSTERED_PATHS):
+        emb_path, ids_path = embedding_paths(algo)
+        if not os.path.exists(emb_path) or not dataset_exists(CLUSTERED_PATHS[algo]):
+            logger.warning(f"Skipping {algo}: embeddings or dataset missing")
+            continue
+        header = dataset_columns(CLUSTERED_PATHS[algo])
+        cluster_col = [c for c in header if c.startswith("cluster_")][0]
+        df = read_dataset(CLUSTERED_PATHS[algo], columns=["id", cluster_col])
+        ids = df["id"].to_numpy(dtype=object)
+        if not np.array_equal(np.load(ids_path), ids.astype(str)):
+            logger.warning(f"Skipping {algo}: embeddings are stale, rebuild them first")
+            continue
+        X = np.load(emb_path)
+        for mode in (modes or TOPK_MODES):
+            if mode == "knn" and len(ids) > max_exact_rows:
+                logger.info(f"Skipping {algo} knn table: {len(ids)} rows > max_exact_rows={max_exact_rows}, ANN index is used")
+                continue
+            indices, scores = build_topk_table(
+                X, ids, df[cluster_col].to_numpy(), k=k, mode=mode, chunk_size=chunk_size, n_jobs=n_jobs
+            )
+            save_topk_table(algo, mode, indices, scores, ids)
+            logger.info(f"Saved top-{k} {mode} table for {algo} ({len(ids)} rows)")
+            built[(algo, mode)] = topk_paths(algo, mode)[0]
+    return built
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_all_topk_tables()
@@ -0,0 +1,287 @@
+# utils/tuning.py
+"""
+Parallel, resumable tuning for the clustering models.
+
+Each tuner's grid is expanded into independent trials by the plan_* builder
+next to it in models/ (the same one the serial tune_* uses). Trials that share an
+expensive step (one agglomerative merge tree, one spectral embedding) are
+grouped into one task; every other trial is its own task. Tasks run on a
+joblib process pool of n_jobs workers, and each worker writes finished
+trials to results/trials/<algo>/<trial_id>.json as soon as they complete.
+
+The trial id hashes the algo, the params, the tuner settings, the tuner's
+source and the input matrix, so a restarted run skips everything already on
+disk and a changed input or tuner never picks up stale trials. Results come back in the same order and
+format as the tuners themselves return them.
+"""
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from tqdm import tqdm
+
+from utils import evaluation, profiling
+from utils.evaluation import ClusterEvaluator
+from utils.profiling import COST_COLUMNS
+from utils.pipeline import code_version
+from models import dbscan_model, agglomerative_model, gmm_model, spectral_model
+from models.dbscan_model import plan_dbscan, run_dbscan_trial
+from models.agglomerative_model import plan_agglomerative, run_linkage
+from models.gmm_model import plan_gmm, run_gmm_trial, warm_gmm_search
+from models.spectral_model import plan_spectral, run_spectral_setting
+
+logger = logging.getLogger(__name__)
+
+TRIALS_DIR = "results/trials"
+
+# Per-worker state for the current input matrix: evaluator + shared precomputes
+_WORKER_STATE = {"key": None}
+
+
+def data_digest(X):
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha1(f"{X.shape}:{X.dtype}".encode("utf-8"))
+    h.update(X.tobytes())
+    return h.hexdigest()[:12]
+
+
+def _to_builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+
+def trial_id(algo, params, context):
+    payload = json.dumps({"algo": algo, "params": params, **context}, sort_keys=True, default=_to_builtin)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# =============================
+# Runners: one task (a group of trials) inside a worker
+# =============================
+def _run_dbscan(X_used, evaluator, trials, settings, state):
+    graphs = state.setdefault("dbscan_graphs", {})
+    return [run_dbscan_trial(X_used, evaluator, p, graphs, eps_max=settings["eps_range"][1]) for p in trials]
+
+
+def _run_agglomerative(X_used, evaluator, trials, settings, state):
+    scored = run_linkage(X_used, evaluator, trials[0]["linkage"], [p["n_clusters"] for p in trials])
+    return [scored[p["n_clusters"]] for p in trials]
+
+
+def _run_gmm(X_used, evaluator, trials, settings, state):
+    if settings["mode"] == "warm":
+        scored = warm_gmm_search(
+            X_used, evaluator, settings["ks"], settings["cov_types"],
+            settings["random_state"], settings["top_n"], settings["criterion"]
+        )
+        by_params = {(r["params"]["n_components"], r["params"]["covariance_type"]): r for r in scored}
+        return [by_params[(p["n_components"], p["covariance_type"])] for p in trials]
+    return [
+        run_gmm_trial(X_used, evaluator, p["n_components"], p["covariance_type"], settings["random_state"])
+        for p in trials
+    ]
+
+
+def _run_spectral(X_used, evaluator, trials, settings, state):
+    affinity = trials[0]["affinity"]
+    name = "gamma" if affinity == "rbf" else "n_neighbors"
+    pairs = [(p["n_clusters"], p["assign_labels"]) for p in trials]
+    scored = run_spectral_setting(
+        X_used, evaluator, affinity, name, trials[0][name], pairs,
+        settings["n_components"], settings["random_state"]
+    )
+    return [scored[pair] for pair in pairs]
+
+
+TUNERS = {
+    "dbscan": (plan_dbscan, _run_dbscan, dbscan_model),
+    "agglomerative": (plan_agglomerative, _run_agglomerative, agglomerative_model),
+    "gmm": (plan_gmm, _run_gmm, gmm_model),
+    "spectral": (plan_spectral, _run_spectral, spectral_model),
+}
+
+
+def _save_trial(path, record):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f, default=_to_builtin)
+    os.replace(tmp, path)  # atomic: a crash never leaves a half-written trial
+
+
+def _run_task(algo, X_used, key, trials, paths, settings, eval_memory_mb):
+    """Worker entry point: run one group of trials and persist each result."""
+    if _WORKER_STATE["key"] != key:
+        _WORKER_STATE.clear()
+        _WORKER_STATE["key"] = key
+        _WORKER_STATE["evaluator"] = ClusterEvaluator(X_used, max_memory_mb=eval_memory_mb)
+    run = TUNERS[algo][1]
+    results = run(X_used, _WORKER_STATE["evaluator"], trials, settings, _WORKER_STATE)
+    for path, params, result in zip(paths, trials, results):
+        _save_trial(path, {"algo": algo, "params": params, "result": result})
+    return len(trials)
+
+
+def _trial_tasks(algo, X_used, trials, groups, settings, trials_dir, eval_memory_mb, n_jobs, only=None):
+    """
+    (paths for every trial, tasks for the ones not on disk yet, number of
+    trials in those tasks). only restricts the tasks to those trial indices.
+    Every worker caches its own distance matrix, so each one gets its share
+    of eval_memory_mb (split like topk_table.seed_chunk_size).
+    """
+    worker_memory_mb = eval_memory_mb / effective_n_jobs(n_jobs)
+    key = data_digest(X_used)
+    context = {"data": key, "settings": settings, "code": code_version(TUNERS[algo][2], evaluation, profiling)}
+    paths = [
+        os.path.join(trials_dir, algo, f"{trial_id(algo, params, context)}.json")
+        for params in trials
+    ]
+    wanted = set(range(len(trials)) if only is None else only)
+    tasks, n_todo = [], 0
+    for group in groups:
+        todo = [i for i in group if i in wanted and not os.path.exists(paths[i])]
+        if todo:
+            n_todo += len(todo)
+            tasks.append(delayed(_run_task)(
+                algo, X_used, key, [trials[i] for i in todo], [paths[i] for i in todo],
+                settings, worker_memory_mb
+            ))
+    logger.info(f"{algo} (n={len(X_used)}): {len(wanted)} trials, {len(wanted) - n_todo} already done")
+    return paths, tasks, n_todo
+
+
+def _execute(tasks, n_todo, n_jobs, desc="Tuning trials"):
+    if not tasks:
+        return
+    progress = tqdm(total=n_todo, desc=desc)
+    for n_done in Parallel(n_jobs=n_jobs, return_as="generator_unordered")(tasks):
+        progress.update(n_done)
+    progress.close()
+
+
+def _load_results(paths):
+    records = []
+    for path in paths:
+        with open(path, "r") as f:
+            records.append(json.load(f)["result"])
+    return records
+
+
+def run_tuning(X, specs, n_jobs=-1, trials_dir=TRIALS_DIR, eval_memory_mb=512):
+    """
+    Tune several algorithms on X in parallel.
+        specs: {algo: tuner kwargs}, e.g. {"gmm": {"cluster_range": (3, 10)}}.
+               A "halving" entry ({"min_size": ..., "eta": ...}) runs that
+               algo through run_halving instead of the full grid.
+        n_jobs: worker processes (the core budget); -1 uses every core
+        eval_memory_mb: cap for the cached distance matrices of all workers together
+    Returns {algo: results list}, as the matching tune_* function would.
+    """
+    tasks, plans, n_todo = [], {}, 0
+    for algo, kwargs in specs.items():
+        if algo not in TUNERS:
+            raise ValueError(f"Unsupported algo: {algo}")
+        if "halving" in kwargs:
+            continue
+        X_used, trials, groups, settings = TUNERS[algo][0](X, **kwargs)
+        paths, algo_tasks, algo_todo = _trial_tasks(
+            algo, X_used, trials, groups, settings, trials_dir, eval_memory_mb, n_jobs
+        )
+        tasks += algo_tasks
+        n_todo += algo_todo
+        plans[algo] = paths
+    _execute(tasks, n_todo, n_jobs)
+
+    results = {}
+    for algo, kwargs in specs.items():
+        if "halving" in kwargs:
+            kwargs = dict(kwargs)
+            halving = kwargs.pop("halving")
+            results[algo] = run_halving(
+                X, algo, n_jobs=n_jobs, trials_dir=trials_dir, eval_memory_mb=eval_memory_mb, **halving, **kwargs
+            )
+        else:
+            # DBSCAN drops rejected trials, like smart_tune_dbscan
+            results[algo] = [r for r in _load_results(plans[algo]) if r is not None]
+    return results
+
+
+def run_halving(X, algo, min_size=1000, eta=3, n_jobs=-1, trials_dir=TRIALS_DIR, eval_memory_mb=512, **kwargs):
+    """
+    Successive halving over the algo's grid (kwargs as for the tune_* function).
+
+    Every configuration is scored on a min_size-row subsample of the tuner's
+    sample; the best 1/eta (by silhouette) survive and are re-scored on eta
+    times more rows, until the last rung, which uses the tuner's full sample.
+    Subsamples are nested prefixes of one permutation, and every rung runs
+    on the pool with the same resumable trial files as run_tuning (the last
+    rung reuses run_tuning's own trials).
+
+    Rows come back in the tuner's order with "rung" and "n_samples".
+    Configurations eliminated early keep their last score as
+    "halving_silhouette" but report None metrics, so they never outrank
+    full-sample results. Note that DBSCAN's eps / min_samples depend on
+    density, so small rungs transfer poorly for it.
+    """
+    X_used, trials, groups, settings = TUNERS[algo][0](X, **kwargs)
+    if settings.get("mode") == "warm":
+        raise ValueError("Successive halving needs independent trials, use mode='grid'")
+
+    n_full = len(X_used)
+    order = np.random.RandomState(settings["random_state"]).permutation(n_full)
+    size = min(min_size, n_full)
+    alive = list(range(len(trials)))
+    last = {}
+    rung = 0
+
+    while True:
+        X_rung = X_used if size >= n_full else X_used[order[:size]]
+        paths, tasks, n_todo = _trial_tasks(
+            algo, X_rung, trials, groups, settings, trials_dir, eval_memory_mb, n_jobs, only=alive
+        )
+        _execute(tasks, n_todo, n_jobs, desc=f"{algo} rung {rung} (n={len(X_rung)})")
+        for i, record in zip(alive, _load_results([paths[i] for i in alive])):
+            last[i] = (rung, len(X_rung), record)
+        if size >= n_full:
+            break
+
+        def score(i):
+            record = last[i][2]
+            if record is None or record.get("silhouette") is None:
+                return -np.inf
+            return record["silhouette"]
+
+        ranked = sorted(alive, key=score, reverse=True)
+        keep = ranked[:max(1, int(np.ceil(len(alive) / eta)))]
+        alive = sorted(i for i in keep if score(i) > -np.inf)
+        if not alive:
+            break
+        size *= eta
+        if len(alive) == 1 or size * eta > n_full:
+            size = n_full  # no rung just short of the full sample
+        rung += 1
+
+    results = []
+    for i in range(len(trials)):
+        rung_i, n_i, record = last[i]
+        if record is None:
+            continue  # DBSCAN: rejected trial
+        if n_i < n_full:
+            record = {
+                "silhouette": None,
+                "davies_bouldin": None,
+                "calinski_harabasz": None,
+                "params": record["params"],
+                "note": f"Eliminated at rung {rung_i} (n={n_i})",
+                "halving_silhouette": record.get("silhouette"),
+                **{name: record.get(name) for name in COST_COLUMNS},
+            }
+        record["rung"] = rung_i
+        record["n_samples"] = n_i
+        results.append(record)
+    return results